@@ -235,6 +235,132 @@ class QualityMetric(TypedDict):
 # 
 # This `quality_history` allow us to plot the agent improvement over time and programmatically diagnose if the refinement process is stalling or has successfully converged to a high-quality output.
 # 
+# The facts themselves need a better home than a plain list. With `operator.add`, every pruning step appends its facts, so the same statement extracted from three pages is stored three times, and the list only ever grows. Every refinement then rebuilds the findings string from the whole list, even though the draft already reflects most of it.
+# 
+# So the `knowledge_base` becomes a `FactStore`:
+# 
+# 1.  Facts are keyed by a hash of their normalized content. A repeat from another source doesn't add a copy; it can only raise the confidence or mark the fact as disputed.
+# 2.  Indexes by confidence decile and by `is_disputed`, plus the set of sources behind each fact, answer the questions the Supervisor asks when it refines the draft: what is new, what is disputed, and what rests on a single weak source.
+# 3.  Every batch of changes is a new `version`, and `since(version)` returns only the facts added or changed after it. A refinement step only has to read what is new.
+# 4.  `merge_facts` is the LangGraph reducer that replaces `operator.add`, so nodes keep returning plain lists of `Fact`s. It merges into a copy, so the state a node was given never changes underneath it.
+
+# %%
+import bisect
+import hashlib
+from typing import Iterable
+
+LOW_CONFIDENCE_SCORE = 50  # Facts scored below this and reported by a single source are flagged when refining
+
+class FactStore:
+    """The knowledge base: deduplicated facts indexed by source, confidence and dispute status, with a version log."""
+
+    def __init__(self):
+        self.version = 0
+        self._facts: dict[str, Fact] = {}
+        self._sources: dict[str, set] = {}        # Every source that reported each fact, for corroboration
+        self._by_confidence: dict[int, set] = {}  # Confidence decile (0-10) -> fact keys
+        self._disputed: set = set()
+        self._log_versions: List[int] = []        # Parallel lists: the version at which each key was added or changed
+        self._log_keys: List[str] = []
+
+    @staticmethod
+    def key(content: str) -> str:
+        # Facts that differ only in case, spacing or a trailing period are the same fact.
+        normalized = " ".join(content.lower().split()).rstrip(".")
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+
+    def __len__(self) -> int:
+        return len(self._facts)
+
+    def __iter__(self):
+        return iter(self._facts.values())
+
+    def __contains__(self, fact: Fact) -> bool:
+        return self.key(fact.content) in self._facts
+
+    def copy(self) -> "FactStore":
+        """An independent store with the same facts, indexes and version log; Facts themselves are never mutated, so they are shared."""
+        clone = FactStore()
+        clone.version = self.version
+        clone._facts = dict(self._facts)
+        clone._sources = {key: set(sources) for key, sources in self._sources.items()}
+        clone._by_confidence = {decile: set(keys) for decile, keys in self._by_confidence.items()}
+        clone._disputed = set(self._disputed)
+        clone._log_versions = list(self._log_versions)
+        clone._log_keys = list(self._log_keys)
+        return clone
+
+    def _index(self, key: str, fact: Fact, version: int) -> None:
+        self._facts[key] = fact
+        self._by_confidence.setdefault(fact.confidence_score // 10, set()).add(key)
+        if fact.is_disputed:
+            self._disputed.add(key)
+        self._log_versions.append(version)
+        self._log_keys.append(key)
+
+    def _unindex(self, key: str, fact: Fact) -> None:
+        self._by_confidence[fact.confidence_score // 10].discard(key)
+        self._disputed.discard(key)
+
+    def _put(self, key: str, fact: Fact, version: int) -> bool:
+        existing = self._facts.get(key)
+        if existing == fact:
+            return False
+        if existing is not None:
+            self._unindex(key, existing)
+        self._index(key, fact, version)
+        return True
+
+    def add(self, facts: Iterable[Fact]) -> int:
+        """Merges a batch of facts as one new version, returning how many facts were added or changed."""
+        version, changed = self.version + 1, 0
+        for fact in facts:
+            key = self.key(fact.content)
+            self._sources.setdefault(key, set()).add(fact.source_url)
+            existing = self._facts.get(key)
+            if existing is not None:
+                # 1. A repeat keeps the better-supported source, and a conflict reported by anyone marks the fact as disputed.
+                fact = existing.model_copy(update={
+                    "confidence_score": max(existing.confidence_score, fact.confidence_score),
+                    "source_url": fact.source_url if fact.confidence_score > existing.confidence_score else existing.source_url,
+                    "is_disputed": existing.is_disputed or fact.is_disputed,
+                })
+            changed += self._put(key, fact, version)
+        if changed:
+            self.version = version
+        return changed
+
+    def with_confidence(self, min_score: int, max_score: int = 100) -> List[Fact]:
+        # 2. Only the deciles in range are scanned, then filtered to the exact bounds.
+        keys = (key for decile in range(min_score // 10, max_score // 10 + 1) for key in self._by_confidence.get(decile, ()))
+        return [fact for fact in map(self._facts.get, keys) if min_score <= fact.confidence_score <= max_score]
+
+    def disputed(self) -> List[Fact]:
+        return [self._facts[key] for key in self._disputed]
+
+    def corroboration(self, fact: Fact) -> int:
+        """How many distinct sources reported this fact."""
+        return len(self._sources.get(self.key(fact.content), ()))
+
+    def since(self, version: int) -> List[Fact]:
+        """Facts added or changed after the given version, each listed once."""
+        # 3. The log is sorted by version, so finding the start is a binary search, not a scan of the whole store.
+        start = bisect.bisect_right(self._log_versions, version)
+        return [self._facts[key] for key in dict.fromkeys(self._log_keys[start:])]
+
+def merge_facts(store: Optional[FactStore], update) -> FactStore:
+    """The knowledge_base reducer: merges new facts into a copy of the store instead of appending duplicates."""
+    store = store if isinstance(store, FactStore) else FactStore()
+    if update is store or not update:
+        return store
+    merged = store.copy()
+    merged.add(update)
+    return merged
+
+def format_fact(fact: Fact) -> str:
+    return f"- {fact.content} [{fact.source_url}] (Confidence: {fact.confidence_score}{', DISPUTED' if fact.is_disputed else ''})"
+
+# %% [markdown]
 # Now we can assemble these smaller components into the main state for our Supervisor agent, the brain of the entire operation.
 
 # %%
@@ -252,7 +378,10 @@ class SupervisorState(TypedDict):
     # This is a key memory management design. 'raw_notes' is a temporary, high-volume buffer
     # for unprocessed search results. 'knowledge_base' is the permanent, structured, and pruned storage.
     raw_notes: Annotated[List[str], operator.add] 
-    knowledge_base: Annotated[List[Fact], operator.add]
+    knowledge_base: Annotated[FactStore, merge_facts]
+
+    # The knowledge_base version the draft was last refined against, so the next refinement only reads newer facts.
+    refined_kb_version: int
     
     # A simple counter to prevent infinite loops in our iterative process.
     research_iterations: int
@@ -289,11 +418,25 @@ class ResearcherState(TypedDict):
     # The temporary buffer of raw search results for this specific worker.
     raw_notes: Annotated[List[str], operator.add]
 
+    # The running summary of the ReAct loop, updated after every step.
+    research_summary: str
+    compressed_through: int  # Number of researcher_messages already folded into research_summary
+
+    # Prompt and completion tokens of every llm_call turn, in order.
+    turn_token_usage: Annotated[List[dict], operator.add]
+
+    # Budget accounting: when the researcher started, what it has spent, and which limit stopped it (if any).
+    started_at: float
+    tool_calls: int
+    search_calls: int
+    budget_exhausted: Optional[str]
+
 # A specialized state defining the output of the research agent sub-graph.
 class ResearcherOutputState(TypedDict):
     compressed_research: str
     raw_notes: Annotated[List[str], operator.add]
     researcher_messages: Annotated[Sequence[BaseMessage], add_messages]
+    budget_exhausted: Optional[str]
 
 # The states for the top-level, user-facing graph.
 class AgentInputState(MessagesState):
@@ -340,6 +483,11 @@ class ConductResearch(BaseModel):
     research_topic: str = Field(
         description="The topic to research. Should be a single, self-contained topic described in high detail.",
     )
+    # Decides which topics run first when the Supervisor asks for more than can be researched at once.
+    priority: int = Field(
+        default=0,
+        description="Higher values run first when more topics are requested than can be researched at once.",
+    )
 
 # %% [markdown]
 # The `ConductResearch` tool is the **work order** for our system. It's a simple Pydantic model that encapsulates a single research task.
@@ -379,6 +527,12 @@ def think_tool(reflection: str) -> str:
     """
     return f"Reflection recorded: {reflection}"
 
+async def athink_tool(reflection: str) -> str:
+    return think_tool.func(reflection)
+
+# think_tool keeps its synchronous function for 'invoke' and gains a coroutine for 'ainvoke'.
+think_tool.coroutine = athink_tool
+
 # %% [markdown]
 # In this component we are enabling a **chain-of-thought** style of reasoning within our agents.
 # 
@@ -931,17 +1085,44 @@ After each search tool call, use think_tool to analyze the results:
 # %%
 from langchain_core.messages import SystemMessage, ToolMessage, filter_messages
 
-def llm_call(state: ResearcherState):
+async def llm_call(state: ResearcherState):
     """The 'brain' of the researcher: analyzes the current state and decides on the next action (call a tool or finish)."""
-    
-    # This node invokes our tool-bound model with the specific research_agent_prompt and the current message history for this sub-task.
-    return {
-        "researcher_messages": [
-            model_with_tools.invoke(
-                [SystemMessage(content=research_agent_prompt.format(date=get_today_str()))] + state["researcher_messages"]
-            )
-        ]
-    }
+    started_at = state.get("started_at") or time.time()
+    state = {**state, "started_at": started_at}
+
+    # A researcher that is already over its budget (see 'ResearcherBudget' later on) doesn't get another turn.
+    limit = researcher_budget.exhausted(state)
+    if limit:
+        budget_stop(state, limit)
+        return {"budget_exhausted": limit, "started_at": started_at}
+
+    # This node invokes our tool-bound model with the specific research_agent_prompt and the message history for this sub-task.
+    # The history is a token-budgeted view built by 'window_researcher_messages', which we define later on.
+    system_message = SystemMessage(content=research_agent_prompt.format(date=get_today_str()))
+    budget = RESEARCHER_CONTEXT_TOKENS - estimate_message_tokens(system_message)
+    prompt = [system_message] + window_researcher_messages(state["researcher_messages"], state.get("research_summary", ""), state.get("compressed_through", 0), budget)
+
+    # Awaiting 'ainvoke' lets a researcher waiting on Ollama give the event loop back to the other researchers.
+    response = await model_with_tools.ainvoke(prompt)
+
+    # Ollama reports exact counts in usage_metadata; without them we fall back to our estimate.
+    usage = getattr(response, "usage_metadata", None) or {}
+    prompt_tokens = usage.get("input_tokens") or sum(estimate_message_tokens(m) for m in prompt)
+    completion_tokens = usage.get("output_tokens") or estimate_message_tokens(response)
+    print(f"  researcher turn {len(state.get('turn_token_usage', [])) + 1}: {prompt_tokens} prompt tokens, {completion_tokens} completion tokens")
+    turn_usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+
+    # If the tool calls the model just planned would go over budget, we keep its text but not the calls.
+    update = {"turn_token_usage": [turn_usage], "started_at": started_at}
+    if response.tool_calls:
+        limit = researcher_budget.exhausted({**state, "turn_token_usage": state.get("turn_token_usage", []) + [turn_usage]}, response.tool_calls)
+        if limit:
+            budget_stop(state, limit)
+            response = AIMessage(content=response.content)
+            update["budget_exhausted"] = limit
+
+    update["researcher_messages"] = [response]
+    return update
 
 # %% [markdown]
 # The `research_agent_prompt` is the **Standard Operating Procedure** for our individual researchers.
@@ -953,39 +1134,70 @@ def llm_call(state: ResearcherState):
 # Now, we can define the `llm_call` node, which is the "brain" of the researcher.
 
 # %% [markdown]
-# The `llm_call` function is the reasoning engine for our worker agent. It's a simple but powerful node that takes the entire `researcher_messages` history for its specific sub-task and passes it to our `model_with_tools`.
+# The `llm_call` function is the reasoning engine for our worker agent. It's a simple but powerful node that takes the `researcher_messages` history for its specific sub-task and passes it to our `model_with_tools`. As the history grows, it is trimmed to a token budget, which we will come back to later.
 # 
 # The model response will either be a final thought or, more likely, a decision to call one of its available tools (`tavily_search` or `think_tool`).
 # 
 # Next, we need the **“hands”** of our researcher. The `tool_node` is responsible for executing any tool calls that the `llm_call` node has planned.
+# 
+# The calls in one turn are independent of each other. Running them one after another would make a turn with three `tavily_search` calls take the **sum** of the three latencies instead of the slowest one, so `tool_node` runs them concurrently through `ainvoke`:
+# 
+# 1.  `TOOL_CONCURRENCY` caps how many tool calls a single researcher has in flight. The searches still go through the shared search and summarization semaphores, so this cap only stops one turn from grabbing all of them.
+# 2.  Each tool gets its own timeout from `TOOL_TIMEOUTS`. A search that hangs becomes an error `ToolMessage` the model can react to, instead of stalling the whole researcher.
+# 3.  `asyncio.gather` returns results in the order of its inputs, so the `ToolMessage`s come back in exactly the same order as the `tool_calls`.
 
 # %%
-def tool_node(state: ResearcherState):
-    """The 'hands' of the researcher: executes all tool calls from the previous LLM response."""
-    
-    # We get the most recent message from the state, which should contain the tool calls.
+TOOL_CONCURRENCY = 3        # Maximum tool calls a single researcher runs at once
+DEFAULT_TOOL_TIMEOUT = 60.0 # Seconds allowed for a tool without its own entry below
+TOOL_TIMEOUTS = {
+    "tavily_search": 180.0, # Search, fetch and summarize, including retries
+    "think_tool": 10.0,
+}
+
+async def run_tool_call(tool_call: dict, semaphore: asyncio.Semaphore, deadline: Optional[float] = None) -> ToolMessage:
+    """Execute one tool call under the researcher's concurrency cap and the tool's timeout, never running past `deadline`."""
+    name = tool_call["name"]
+
+    # 1. An unknown tool name is reported back to the model rather than crashing the researcher.
+    tool = tools_by_name.get(name)
+    if tool is None:
+        return ToolMessage(content=f"Error: unknown tool '{name}'", name=name, tool_call_id=tool_call["id"], status="error")
+
+    # 2. Timeouts and tool failures become error observations, so the other calls in this turn still complete.
+    async with semaphore:
+        timeout = TOOL_TIMEOUTS.get(name, DEFAULT_TOOL_TIMEOUT)
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.time())
+            if timeout <= 0:
+                return ToolMessage(content=f"Error: {name} skipped, the research time budget is used up", name=name, tool_call_id=tool_call["id"], status="error")
+        try:
+            observation = await asyncio.wait_for(tool.ainvoke(tool_call["args"]), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠ {name} timed out after {timeout:.0f}s")
+            return ToolMessage(content=f"Error: {name} timed out after {timeout:.0f}s", name=name, tool_call_id=tool_call["id"], status="error")
+        except Exception as e:
+            print(f"⚠ {name} failed: {e}")
+            return ToolMessage(content=f"Error: {name} failed: {e}", name=name, tool_call_id=tool_call["id"], status="error")
+
+    return ToolMessage(content=str(observation), name=name, tool_call_id=tool_call["id"])
+
+async def tool_node(state: ResearcherState):
+    """The 'hands' of the researcher: executes all tool calls from the previous LLM response concurrently."""
     tool_calls = state["researcher_messages"][-1].tool_calls
-    
-    # We execute all the planned tool calls.
-    observations = []
-    for tool_call in tool_calls:
-        
-        # We look up the correct tool function by its name.
-        tool = tools_by_name[tool_call["name"]]
-        observations.append(tool.invoke(tool_call["args"]))
-    
-    # We format the results of the tool calls into 'ToolMessage' objects.
-    # This is the standard way to return tool results to the LLM in LangGraph.
-    tool_outputs = [
-        ToolMessage(
-            content=str(observation),
-            name=tool_call["name"],
-            tool_call_id=tool_call["id"]
-        ) for observation, tool_call in zip(observations, tool_calls)
-    ]
-    
-    # We return the tool outputs to be added to the message history.
-    return {"researcher_messages": tool_outputs}
+
+    # 3. One semaphore per turn caps this researcher's concurrency; gather keeps the ToolMessages in tool_call order.
+    #    Every tool timeout is also capped at what is left of the researcher's wall-clock budget.
+    semaphore = asyncio.Semaphore(TOOL_CONCURRENCY)
+    deadline = state.get("started_at", time.time()) + researcher_budget.max_seconds
+    tool_outputs = await asyncio.gather(*(run_tool_call(tool_call, semaphore, deadline) for tool_call in tool_calls))
+
+    # We account for this turn's calls in the budget.
+    return {
+        "researcher_messages": list(tool_outputs),
+        "tool_call_iterations": state.get("tool_call_iterations", 0) + 1,
+        "tool_calls": state.get("tool_calls", 0) + len(tool_calls),
+        "search_calls": state.get("search_calls", 0) + sum(1 for call in tool_calls if call["name"] == "tavily_search"),
+    }
 
 # %% [markdown]
 # The `tool_node` is the action part of our ReAct loop. It inspects the last `AIMessage`, extracts the `tool_calls`, and executes them. By returning the results as `ToolMessage` objects, it provides the LLM with the **observations** it needs for its next reasoning step.
@@ -1000,6 +1212,10 @@ def should_continue(state: ResearcherState) -> Literal["tool_node", "compress_re
     messages = state["researcher_messages"]
     last_message = messages[-1]
 
+    # An exhausted budget always ends the loop, whatever the last message says.
+    if state.get("budget_exhausted"):
+        return "compress_research"
+
     # If the last message from the LLM contains tool calls, we continue the loop.
     if last_message.tool_calls:
         return "tool_node"
@@ -1103,10 +1319,7 @@ class Summary(BaseModel):
 # Now, let’s build the utility functions that will form our search pipeline, starting with the function that calls the Tavily API.
 
 # %%
-from tavily import TavilyClient
-
-# We initialize the Tavily client.
-tavily_client = TavilyClient(api_key="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")
+# The Tavily client itself is created by the search provider further below, which reads the API key from TAVILY_API_KEY.
 MAX_CONTEXT_LENGTH = 250000
 
 def tavily_search_multiple(
@@ -1115,19 +1328,23 @@ def tavily_search_multiple(
     topic: Literal["general", "news", "finance"] = "general", 
     include_raw_content: bool = True, 
     ) -> List[dict]:
-    """A helper function to perform a search using the Tavily API for a list of queries."""
+    """A helper function to perform a search using the configured search provider (Tavily by default) for a list of queries."""
 
-    print(f"--- [TOOL] Executing Tavily search for queries: {search_queries} ---")
+    print(f"--- [TOOL] Executing {search_provider.name} search for queries: {search_queries} ---")
     search_docs = []
 
-    # We execute the searches for each query.
+    # We execute the searches for each query. 'search_provider' and the search result caches are set up further below.
     for query in search_queries:
-        result = tavily_client.search(
-            query,
-            max_results=max_results,
-            include_raw_content=include_raw_content,
-            topic=topic
-        )
+        key = SearchResultCache.key(query, max_results, topic, include_raw_content)
+        result = lookup_search_cache(key, query)
+        if result is None:
+            result = search_provider.search(
+                query,
+                max_results=max_results,
+                include_raw_content=include_raw_content,
+                topic=topic
+            )
+            store_search_result(key, query, result)
         search_docs.append(result)
     return search_docs
 
@@ -1139,6 +1356,60 @@ def tavily_search_multiple(
 # 1.  If the Supervisor asks a question about stock prices, the agent can programmatically switch the search topic from general to finance.
 # 2.  If the question is about a breaking event, it can switch to news. This moves us beyond simple keyword matching and allows the agent to select the correct index for the job.
 # 
+# There is one problem with this loop: every query waits for the one before it. A research step with four queries takes the **sum** of four round trips, even though the queries are completely independent.
+# 
+# So let's add an async search function that runs over a single, pooled HTTP client, so independent queries can be awaited together instead of one after another.
+
+# %%
+import random
+import httpx
+
+# Search fan-out settings
+SEARCH_CONCURRENCY = 4    # Maximum Tavily queries in flight at once, across all researchers
+SEARCH_TIMEOUT = 30.0     # Seconds allowed for a single query attempt
+SEARCH_RETRIES = 2        # Extra attempts after a timeout, a 429 or a 5xx response
+SEARCH_BACKOFF = 1.0      # Base delay in seconds for exponential backoff
+
+search_semaphore = asyncio.Semaphore(SEARCH_CONCURRENCY)
+
+def is_retryable_search_error(error: Exception) -> bool:
+    """Timeouts, connection errors, rate limits and server errors are worth retrying; bad requests are not."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+async def tavily_search_async(
+    query: str,
+    max_results: int = 3,
+    topic: Literal["general", "news", "finance"] = "general",
+    include_raw_content: bool = True,
+) -> dict:
+    """Runs a single query on the configured search provider with a timeout and jittered retries, returning an empty result if it keeps failing."""
+    for attempt in range(SEARCH_RETRIES + 1):
+        try:
+            # 1. We only hold a concurrency slot while the request is actually in flight.
+            #    With the default Tavily provider, the request goes through the provider's pooled HTTP client.
+            async with search_semaphore:
+                return await asyncio.wait_for(
+                    search_provider.asearch(query, max_results=max_results, topic=topic, include_raw_content=include_raw_content),
+                    timeout=SEARCH_TIMEOUT,
+                )
+        except Exception as e:
+            if attempt == SEARCH_RETRIES or not is_retryable_search_error(e):
+                # 2. A failed query must not sink the whole step, so we degrade to "no results" for this query only.
+                print(f"Search failed for '{query}': {str(e)}")
+                return {"query": query, "results": []}
+
+            # 3. Full jitter: a random delay up to the exponential backoff, so parallel retries don't hit Tavily in lockstep.
+            await asyncio.sleep(random.uniform(0, SEARCH_BACKOFF * 2 ** attempt))
+
+# %% [markdown]
+# `tavily_search_async` returns exactly what the Tavily client's `search` returns, a single Tavily response, so the rest of the pipeline doesn't need to change. But because it is a coroutine, queries issued together run concurrently, and a multi-query step takes about as long as its **slowest** query instead of the sum of all of them.
+# 
+# 1.  The Tavily provider, which we build a little later, sends every async query through one pooled HTTP client. It keeps connections alive between calls, so we stop paying a fresh TCP and TLS handshake for every query.
+# 2.  `search_semaphore` is a global cap. Even when several researchers search at once, we never have more than `SEARCH_CONCURRENCY` requests open against the API.
+# 3.  Each attempt gets its own `SEARCH_TIMEOUT`, and transient failures are retried with jittered exponential backoff. A query that still fails comes back as an empty result rather than an exception.
+# 
 # Next, we will build the function that orchestrates the summarization for a given piece of web content.
 
 # %%
@@ -1147,6 +1418,12 @@ summarization_model = init_chat_model(model="gpt-oss:20b", base_url="http://loca
 
 def summarize_webpage_content(webpage_content: str) -> str:
     """Summarizes a single piece of webpage content using our configured summarization model."""
+    # A repeat summarization costs a lookup in the summary cache (built later in this section) instead of an LLM call.
+    key = summary_cache_key(webpage_content)
+    cached = summary_cache.get(key)
+    if cached is not None:
+        return cached
+
     try:
         # We bind our 'Summary' Pydantic schema to the summarization model.
         structured_model = summarization_model.with_structured_output(Summary)
@@ -1165,6 +1442,9 @@ def summarize_webpage_content(webpage_content: str) -> str:
             f"<summary>\n{summary_result.summary}\n</summary>\n\n"
             f"<key_excerpts>\n{summary_result.key_excerpts}\n</key_excerpts>"
         )
+
+        # We store only real summaries, never the fallback.
+        summary_cache.put(key, formatted_summary)
         return formatted_summary
     except Exception as e:
 
@@ -1179,16 +1459,17 @@ def summarize_webpage_content(webpage_content: str) -> str:
 
 # %%
 def deduplicate_search_results(search_results: List[dict]) -> dict:
-    """Deduplicates a list of search results based on the URL."""
-    unique_results = {}
+    """Deduplicates search results by canonical URL and near-duplicate content, across the whole research run."""
+    # The run-wide duplicate index and resolve_duplicate are built further below, together with near-duplicate detection.
+    index = get_research_run().dedup_index
+    unique_results, seen = {}, set()
 
     for response in search_results:
         for result in response['results']:
-            url = result['url']
-            
-            # We use the URL as a key in a dictionary to automatically handle duplicates.
-            if url not in unique_results:
-                unique_results[url] = result
+            # We use the URL as a key in a dictionary, keeping only results the index doesn't already cover.
+            resolved = resolve_duplicate(result, index, seen)
+            if resolved is not None:
+                unique_results[result['url']] = resolved
     return unique_results
 
 # %%
@@ -1206,6 +1487,14 @@ def process_search_results(unique_results: dict) -> dict:
     return summarized_results
 
 # %%
+def format_search_source(i: int, url: str, result: dict) -> str:
+    """Formats a single summarized source as one numbered block of the search output."""
+    formatted_source = f"\n\n--- SOURCE {i}: {result['title']} ---\n"
+    formatted_source += f"URL: {url}\n\n"
+    formatted_source += f"SUMMARY:\n{result['content']}\n\n"
+    formatted_source += "-" * 80 + "\n"
+    return formatted_source
+
 def format_search_output(summarized_results: dict) -> str:
     """Formats the final, summarized search results into a clean string for the agent."""
     if not summarized_results:
@@ -1213,10 +1502,7 @@ def format_search_output(summarized_results: dict) -> str:
     
     formatted_output = "Search results: \n\n"
     for i, (url, result) in enumerate(summarized_results.items(), 1):
-        formatted_output += f"\n\n--- SOURCE {i}: {result['title']} ---\n"
-        formatted_output += f"URL: {url}\n\n"
-        formatted_output += f"SUMMARY:\n{result['content']}\n\n"
-        formatted_output += "-" * 80 + "\n"
+        formatted_output += format_search_source(i, url, result)
     return formatted_output
 
 # %% [markdown]
@@ -1226,6 +1512,595 @@ def format_search_output(summarized_results: dict) -> str:
 # 2.  `process_search_results` orchestrates the summarization for all unique results.
 # 3.  `format_search_output` then takes these processed results and formats them into a clean, well-structured, and human-readable string that will be returned to the agent as the final tool output.
 # 
+# `process_search_results` is by far the slowest of the three. Every page is a full structured-output LLM call over up to `MAX_CONTEXT_LENGTH` characters, and the loop waits for each summary before starting the next one.
+# 
+# The pages are independent of each other, so we can summarize them concurrently, as long as we don't flood the local model with more requests than it can serve.
+
+# %%
+SUMMARIZATION_CONCURRENCY = 3  # Maximum summaries in flight at once, shared by every researcher
+
+# A process-wide limit, so parallel researchers don't pile dozens of long prompts onto the same Ollama instance.
+summarization_semaphore = asyncio.Semaphore(SUMMARIZATION_CONCURRENCY)
+
+async def try_summarize_webpage_async(webpage_content: str) -> Optional[str]:
+    """Returns the cached or freshly generated summary, or None if the LLM call fails."""
+    key = summary_cache_key(webpage_content)
+    cached = await summary_cache.aget(key)
+    if cached is not None:
+        return cached
+
+    try:
+        structured_model = summarization_model.with_structured_output(Summary)
+
+        # We only hold a slot while the LLM call is running.
+        async with summarization_semaphore:
+            summary_result = await structured_model.ainvoke([
+                HumanMessage(content=summarize_webpage_prompt.format(
+                    webpage_content=webpage_content,
+                    date=get_today_str()
+                ))
+            ])
+        formatted_summary = (
+            f"<summary>\n{summary_result.summary}\n</summary>\n\n"
+            f"<key_excerpts>\n{summary_result.key_excerpts}\n</key_excerpts>"
+        )
+        await summary_cache.aput(key, formatted_summary)
+        return formatted_summary
+    except Exception as e:
+        print(f"Failed to summarize webpage: {str(e)}")
+        return None
+
+async def summarize_webpage_content_async(webpage_content: str) -> str:
+    """The async counterpart of summarize_webpage_content, with the same cache and truncation fallback."""
+    summary = await try_summarize_webpage_async(webpage_content)
+    if summary is None:
+        return webpage_content[:1000] + "..." if len(webpage_content) > 1000 else webpage_content
+    return summary
+
+async def process_search_results_async(unique_results: dict) -> dict:
+    """Summarizes all unique search results concurrently, keeping the original result order."""
+
+    async def process_one(result: dict) -> dict:
+        # 1. Pages with raw content are summarized (long ones by map-reduce, defined below); the rest keep the search API's short snippet.
+        if result.get("raw_content"):
+            content = await summarize_webpage_adaptive_async(result['raw_content'][:MAX_CONTEXT_LENGTH])
+        else:
+            content = result['content']
+        return {'title': result['title'], 'content': content}
+
+    # 2. 'asyncio.gather' returns results in the order of its arguments, so the output order matches the input.
+    processed = await asyncio.gather(*(process_one(result) for result in unique_results.values()))
+    return dict(zip(unique_results.keys(), processed))
+
+# %% [markdown]
+# `process_search_results_async` produces the same dictionary as `process_search_results`, in the same order, but the summaries now overlap instead of queuing behind each other.
+# 
+# 1.  `summarization_semaphore` is shared across the whole process. No matter how many researchers are searching at once, at most `SUMMARIZATION_CONCURRENCY` summaries hit the model together, which keeps a local Ollama server responsive.
+# 2.  The fallback is unchanged: if one summary fails, that page alone degrades to its first 1000 characters and the others are unaffected.
+# 
+# Concurrency hides latency, but we are still paying for work we have already done. Popular pages show up again and again, across parallel researchers, across supervisor iterations and across entire runs, and each time they are summarized from scratch.
+# 
+# A summary only depends on three things: the page content, the prompt, and the model. If we hash those three together, we get a key that we can safely look up in a small, persistent cache before ever calling the LLM.
+
+# %%
+import hashlib
+import sqlite3
+import threading
+import time
+
+# Summary cache settings
+SUMMARY_CACHE_PATH = "summary_cache.db"
+SUMMARY_CACHE_MAX_MB = 256                 # Least recently used summaries are evicted beyond this size
+SUMMARY_CACHE_TTL = 7 * 24 * 3600          # Seconds a summary stays valid; None keeps summaries forever
+
+class SummaryCache:
+    """A persistent SQLite cache of webpage summaries with LRU eviction, an optional TTL and hit-rate counters."""
+
+    def __init__(self, path: str, max_bytes: int, ttl_seconds: Optional[float] = None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # The cache is shared by sync and async summarizers, so every access goes through one lock.
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            "key TEXT PRIMARY KEY, summary TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS summaries_last_access ON summaries (last_access)")
+        self._db.commit()
+
+    @staticmethod
+    def key(webpage_content: str, prompt: str, model_name: str) -> str:
+        """Identifies a summary by the exact content, prompt template and model that produced it."""
+        digest = hashlib.sha256()
+        for part in (model_name, prompt, webpage_content):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns a cached summary, or None if it is missing or has expired."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT summary, created_at FROM summaries WHERE key = ?", (key,)).fetchone()
+            if row and (self.ttl_seconds is None or now - row[1] <= self.ttl_seconds):
+                self._db.execute("UPDATE summaries SET last_access = ? WHERE key = ?", (now, key))
+                self._db.commit()
+                self.hits += 1
+                return row[0]
+            if row:
+                self._db.execute("DELETE FROM summaries WHERE key = ?", (key,))
+                self._db.commit()
+            self.misses += 1
+            return None
+
+    def put(self, key: str, summary: str) -> None:
+        """Stores a summary, then evicts the least recently used entries until the cache fits its size budget."""
+        now = time.time()
+        size = len(summary.encode("utf-8"))
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO summaries (key, summary, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, summary, size, now, now),
+            )
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM summaries").fetchone()[0]
+            while total > self.max_bytes:
+                oldest = self._db.execute("SELECT key, size FROM summaries ORDER BY last_access LIMIT 1").fetchone()
+                if oldest is None:
+                    break
+                self._db.execute("DELETE FROM summaries WHERE key = ?", (oldest[0],))
+                total -= oldest[1]
+                self.evictions += 1
+            self._db.commit()
+
+    async def aget(self, key: str) -> Optional[str]:
+        """The async counterpart of get: the SQLite read runs in a worker thread instead of on the event loop."""
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, summary: str) -> None:
+        """The async counterpart of put, so a commit to disk never stalls other researchers."""
+        await asyncio.to_thread(self.put, key, summary)
+
+    def stats(self) -> dict:
+        """Hit rate and size of the cache, for monitoring how much LLM work it is saving."""
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM summaries").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "size_mb": round(size / (1024 * 1024), 2),
+        }
+
+summary_cache = SummaryCache(SUMMARY_CACHE_PATH, max_bytes=SUMMARY_CACHE_MAX_MB * 1024 * 1024, ttl_seconds=SUMMARY_CACHE_TTL)
+
+def summary_cache_key(webpage_content: str) -> str:
+    """The cache key for summarizing this content with the current prompt and summarization model."""
+    return SummaryCache.key(webpage_content, summarize_webpage_prompt, getattr(summarization_model, "model", ""))
+
+# %% [markdown]
+# The key deliberately uses the prompt **template** rather than the formatted prompt. The formatted prompt contains today's date, which would invalidate every entry at midnight, and `SUMMARY_CACHE_TTL` already controls how long a summary may be reused.
+# 
+# Both summarizers, `summarize_webpage_content` and `summarize_webpage_content_async` (through `try_summarize_webpage_async`), check this cache before calling the model. Only successful summaries are stored. The truncation fallback is never cached, so a page that failed once gets another chance on the next call.
+# 
+# Because `process_search_results` and `process_search_results_async` go through these summarizers, they use the cache without any changes.
+# 
+# `summary_cache.stats()` reports hits, misses and the hit rate, so we can see how much summarization work a run actually avoided. Since the cache lives on disk, the savings carry over from one research run to the next.
+# 
+# There is still one failure mode left. A long page is cut to `MAX_CONTEXT_LENGTH` (250,000 characters, roughly 60k tokens) and sent to the model as **one** prompt. On a local Ollama model, a prompt that size is slow to prefill and often overflows the context window. When that happens, the call fails and we fall back to the first 1000 characters, which throws away almost the entire page.
+# 
+# The fix is a classic **map-reduce**:
+# 
+# 1.  **Map:** split the page into token-bounded chunks and summarize the chunks concurrently.
+# 2.  **Reduce:** merge the chunk summaries a few at a time, and repeat until a single summary remains.
+# 
+# Every LLM call now sees a bounded prompt, so latency grows predictably with page size instead of falling off a cliff.
+
+# %%
+# Map-reduce summarization settings
+CHARS_PER_TOKEN = 4           # Rough characters-per-token estimate, good enough for budgeting prompts
+SUMMARY_CHUNK_TOKENS = 6000   # Pages longer than this are summarized chunk by chunk
+SUMMARY_MERGE_FANIN = 4       # Maximum partial summaries merged by a single reduce call
+
+# The prompt for the reduce step, which combines partial summaries of consecutive sections of one page.
+merge_summaries_prompt = """You are given partial summaries of consecutive sections of a single webpage, in their original order. Merge them into one summary of the whole page.
+
+<partial_summaries>
+{summaries}
+</partial_summaries>
+
+Guidelines:
+1. Preserve every key fact, statistic, data point, date, name and location from the partial summaries.
+2. Remove information that is repeated across sections instead of listing it twice.
+3. Keep the order of events and arguments as they appear in the page.
+4. Keep the most important quotes and excerpts, up to a maximum of 5.
+
+Today's date is {date}.
+"""
+
+def estimate_tokens(text: str) -> int:
+    """A cheap token estimate, so we can budget prompts without loading a tokenizer."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def split_into_chunks(text: str, max_tokens: int) -> List[str]:
+    """Splits text into chunks of at most max_tokens, breaking on paragraph boundaries where possible."""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    chunks, current = [], ""
+    for paragraph in text.split("\n\n"):
+        # 1. A single paragraph longer than a chunk is cut into fixed-size pieces.
+        while len(paragraph) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+
+        # 2. Otherwise we pack whole paragraphs into the current chunk until it is full.
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            chunks.append(current)
+            current = paragraph
+        else:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+async def merge_summaries_async(partial_summaries: List[str]) -> Optional[str]:
+    """The reduce step: merges consecutive partial summaries into one, or returns None if the LLM call fails."""
+    try:
+        structured_model = summarization_model.with_structured_output(Summary)
+        async with summarization_semaphore:
+            summary_result = await structured_model.ainvoke([
+                HumanMessage(content=merge_summaries_prompt.format(
+                    summaries="\n\n".join(partial_summaries),
+                    date=get_today_str()
+                ))
+            ])
+        return (
+            f"<summary>\n{summary_result.summary}\n</summary>\n\n"
+            f"<key_excerpts>\n{summary_result.key_excerpts}\n</key_excerpts>"
+        )
+    except Exception as e:
+        print(f"Failed to merge summaries: {str(e)}")
+        return None
+
+async def map_reduce_summarize_async(webpage_content: str) -> str:
+    """Summarizes an oversized page by summarizing its chunks concurrently and merging them hierarchically."""
+    # 1. A finished map-reduce result is cached under its own key, since it comes from a different set of prompts.
+    key = SummaryCache.key(webpage_content, summarize_webpage_prompt + merge_summaries_prompt, getattr(summarization_model, "model", ""))
+    cached = await summary_cache.aget(key)
+    if cached is not None:
+        return cached
+
+    # 2. MAP: every chunk is summarized concurrently (and cached individually by try_summarize_webpage_async).
+    #    A chunk that fails degrades to its first 1000 characters, and the page result is then not cached.
+    chunks = split_into_chunks(webpage_content, SUMMARY_CHUNK_TOKENS)
+    summaries = list(await asyncio.gather(*(try_summarize_webpage_async(chunk) for chunk in chunks)))
+    complete = all(summary is not None for summary in summaries)
+    summaries = [
+        summary if summary is not None else (chunk[:1000] + "..." if len(chunk) > 1000 else chunk)
+        for chunk, summary in zip(chunks, summaries)
+    ]
+
+    # 3. REDUCE: we merge neighbouring summaries in groups that fit one prompt, level by level, until one is left.
+    budget = SUMMARY_CHUNK_TOKENS * CHARS_PER_TOKEN
+    while len(summaries) > 1:
+        groups, group = [], []
+        for summary in summaries:
+            if group and (len(group) == SUMMARY_MERGE_FANIN or sum(map(len, group)) + len(summary) > budget):
+                groups.append(group)
+                group = []
+            group.append(summary)
+        groups.append(group)
+
+        # A level that cannot combine anything would loop forever, so we stop and keep what we have.
+        if len(groups) == len(summaries):
+            break
+        merged = await asyncio.gather(*(
+            merge_summaries_async(group) if len(group) > 1 else asyncio.sleep(0, result=group[0])
+            for group in groups
+        ))
+        # Losing a merge is much cheaper than losing the content, so a failed group keeps its partial summaries as they are.
+        complete = complete and all(summary is not None for summary in merged)
+        summaries = [
+            summary if summary is not None else "\n\n".join(group)
+            for group, summary in zip(groups, merged)
+        ]
+
+    # 4. Only a result where every map and merge call succeeded is cached; a degraded one is retried next time.
+    final_summary = "\n\n".join(summaries)
+    if complete:
+        await summary_cache.aput(key, final_summary)
+    return final_summary
+
+async def summarize_webpage_adaptive_async(webpage_content: str) -> str:
+    """Short pages are summarized in a single call; pages over SUMMARY_CHUNK_TOKENS go through map-reduce."""
+    if estimate_tokens(webpage_content) <= SUMMARY_CHUNK_TOKENS:
+        return await summarize_webpage_content_async(webpage_content)
+    return await map_reduce_summarize_async(webpage_content)
+
+# %% [markdown]
+# With map-reduce in place, the cost of a page is roughly `ceil(tokens / SUMMARY_CHUNK_TOKENS)` bounded map calls plus a logarithmic number of merge rounds. Both are predictable, and both run under the same `summarization_semaphore` as everything else.
+# 
+# 1.  `split_into_chunks` prefers paragraph boundaries, so a chunk rarely cuts a sentence in half.
+# 2.  A failure now costs much less. A chunk that fails to summarize degrades to its own first 1000 characters, and a failed merge keeps its inputs, instead of the whole page collapsing into the truncation fallback.
+# 3.  Short pages still take the single-call path, so nothing changes for the common case. `process_search_results_async` sends every page through `summarize_webpage_adaptive_async`, which picks the path.
+# 
+# Even with all of this, we are still summarizing pages that were never worth an LLM call: cookie walls, "Access Denied" pages, 404s, login prompts and near-empty navigation shells. Tavily returns them with `raw_content` like any other page, and each one costs a full summarization.
+# 
+# We can catch most of them with a few cheap, non-LLM heuristics that run in microseconds, sitting between `deduplicate_search_results` and `process_search_results`.
+
+# %%
+import re
+
+# Pre-filter thresholds
+MIN_RAW_CONTENT_CHARS = 400     # Below this, the search snippet is about as informative as a summary would be
+MIN_PROSE_RATIO = 0.25          # Share of characters that must sit in sentence-like lines rather than menus and links
+MIN_QUERY_OVERLAP = 0.2         # Share of query terms that must appear somewhere in the page
+DROP_SCORE = 0.2                # Pages scoring below this are dropped entirely
+SUMMARIZE_SCORE = 0.5           # Pages scoring below this keep only their search snippet
+
+# Phrases that give away error pages, bot walls and consent screens.
+BLOCKED_PAGE_PATTERN = re.compile(
+    r"access denied|403 forbidden|404 not found|page not found|enable javascript|verify you are (a )?human"
+    r"|captcha|are you a robot|accept (all )?cookies|cookie (policy|settings)|sign in to continue|subscribe to (continue|read)",
+    re.IGNORECASE,
+)
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in", "is", "it", "of", "on", "or",
+    "that", "the", "to", "vs", "what", "when", "where", "which", "who", "why", "with",
+}
+
+def query_terms(query: str) -> set:
+    """The content words of a query, lowercased and without stopwords."""
+    return {w for w in WORD_PATTERN.findall(query.lower()) if w not in STOPWORDS and len(w) > 1}
+
+def latin_share(text: str) -> float:
+    """The share of letters written in the Latin alphabet, a cheap proxy for the page's language family."""
+    letters = [c for c in text if c.isalpha()]
+    if not letters:
+        return 0.0
+    return sum(1 for c in letters if c < "\u0250") / len(letters)
+
+def score_search_result(result: dict, query: str) -> tuple[float, str]:
+    """Scores how worth summarizing a page is (0-1), and names the main reason when it is not."""
+    raw = result.get("raw_content") or ""
+    if len(raw) < MIN_RAW_CONTENT_CHARS:
+        return 0.3, "too short"
+
+    # 1. Error pages, bot checks and consent walls are short pages dominated by a telltale phrase.
+    sample = raw[:5000]
+    if BLOCKED_PAGE_PATTERN.search(sample) and len(raw) < 5 * MIN_RAW_CONTENT_CHARS:
+        return 0.0, "blocked or error page"
+
+    # 2. Text density: real articles have long, sentence-like lines; menus and link farms don't.
+    lines = [line.strip() for line in sample.splitlines() if line.strip()]
+    prose_chars = sum(len(line) for line in lines if len(line.split()) >= 8)
+    prose_ratio = prose_chars / max(1, sum(len(line) for line in lines))
+
+    # 3. Lexical overlap: how many of the query's content words the page mentions at all.
+    terms = query_terms(query)
+    page_words = set(WORD_PATTERN.findall(raw.lower()))
+    overlap = len(terms & page_words) / len(terms) if terms else 1.0
+
+    # 4. Language: a Latin-script query answered by a page in a different script is unlikely to help.
+    language_match = 1.0 - abs(latin_share(query) - latin_share(sample))
+
+    score = 0.4 * min(1.0, prose_ratio / MIN_PROSE_RATIO) + 0.4 * min(1.0, overlap / MIN_QUERY_OVERLAP) + 0.2 * language_match
+    if overlap == 0:
+        return min(score, DROP_SCORE - 0.01), "no query overlap"
+    if prose_ratio < MIN_PROSE_RATIO:
+        return min(score, SUMMARIZE_SCORE - 0.01), "low text density"
+    if language_match < 0.5:
+        return min(score, SUMMARIZE_SCORE - 0.01), "language mismatch"
+    return score, "ok"
+
+def prefilter_search_results(unique_results: dict, query: str) -> dict:
+    """Drops pages not worth keeping and downgrades weak ones to their search snippet, so only good pages reach the LLM."""
+    kept = {}
+    for url, result in unique_results.items():
+        if not result.get("raw_content"):
+            kept[url] = result
+            continue
+
+        score, reason = score_search_result(result, query)
+        if score < DROP_SCORE:
+            print(f"--- [FILTER] Dropped {url} ({reason}, score {score:.2f}) ---")
+        elif score < SUMMARIZE_SCORE:
+            # Without raw_content, process_search_results falls back to the short snippet and skips the LLM call.
+            print(f"--- [FILTER] Using snippet only for {url} ({reason}, score {score:.2f}) ---")
+            kept[url] = {**result, "raw_content": None}
+        else:
+            kept[url] = result
+    return kept
+
+# %% [markdown]
+# `prefilter_search_results` sorts every page into one of three buckets without making a single LLM call:
+# 
+# 1.  **Drop:** error pages, bot walls and pages that share no words with the query never reach the agent at all.
+# 2.  **Snippet only:** short pages, menu-heavy pages and pages in an unexpected language keep Tavily's short `content` snippet, but skip summarization.
+# 3.  **Summarize:** everything else goes through the summarizer as before.
+# 
+# The thresholds are deliberately conservative. A borderline page is downgraded to its snippet rather than dropped, so the worst case is a slightly thinner source, never a missing one.
+# 
+# There is one more kind of waste that a plain URL comparison can't see. Collapsing **identical** URLs is not enough, because the web is full of pages that are the same thing under a different address:
+# 
+# 1.  The same article with `?utm_source=...` tracking parameters, a `www.` prefix or an `/amp` suffix.
+# 2.  Syndicated copies of a wire story on a dozen news sites.
+# 3.  Mirrors and scraped copies of documentation.
+# 
+# Worse, deduplication that only lasts for a single tool call can't help when parallel researchers find the same page, so each one summarizes it separately.
+# 
+# `deduplicate_search_results` handles both. URLs are canonicalized before comparison, and page content gets a **SimHash** fingerprint, which changes only a few bits when the text changes a little. We keep these in an index that lives for the entire research run and is shared by every researcher, and `deduplicate_search_results` checks every result against it through `resolve_duplicate`.
+
+# %%
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import uuid
+
+# Near-duplicate detection settings
+SIMHASH_MAX_DISTANCE = 3     # Fingerprints this many bits apart (out of 64) count as the same content
+SIMHASH_MIN_WORDS = 50       # Shorter texts are too small to fingerprint reliably
+SIMHASH_MAX_WORDS = 5000     # Fingerprint only the start of very long pages
+
+TRACKING_PARAMS = re.compile(r"^(utm_\w+|gclid|fbclid|msclkid|yclid|mc_cid|mc_eid|igshid|ref|ref_src|_ga|_hsenc|_hsmi)$")
+
+def canonicalize_url(url: str) -> str:
+    """Normalizes a URL so trivially different addresses of the same page compare equal."""
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower().removeprefix("www.")
+    netloc = f"{host}:{parts.port}" if parts.port and parts.port not in (80, 443) else host
+
+    # We drop tracking parameters and sort the rest, so parameter order doesn't matter either.
+    query = urlencode(sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not TRACKING_PARAMS.match(k.lower())
+    ))
+
+    # http/https, trailing slashes and AMP variants all point at the same content.
+    path = re.sub(r"/amp/?$", "", parts.path).rstrip("/") or "/"
+    return urlunsplit(("https", netloc, path, query, ""))
+
+def simhash(text: str) -> Optional[int]:
+    """A 64-bit SimHash over word 3-shingles; near-identical texts get fingerprints a few bits apart."""
+    words = WORD_PATTERN.findall(text.lower())[:SIMHASH_MAX_WORDS]
+    if len(words) < SIMHASH_MIN_WORDS:
+        return None
+
+    weights = [0] * 64
+    for i in range(len(words) - 2):
+        shingle = " ".join(words[i:i + 3]).encode("utf-8")
+        h = int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+class NearDuplicateIndex:
+    """A thread-safe index of pages seen in a research run, matched by canonical URL or by SimHash fingerprint."""
+
+    BANDS = 4  # 64 bits in 4 bands of 16: two fingerprints within 3 bits must agree exactly on at least one band
+
+    def __init__(self, max_distance: int = SIMHASH_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self.url_duplicates = 0
+        self.content_duplicates = 0
+        self._lock = threading.Lock()
+        self._by_url: dict[str, dict] = {}
+        self._bands: dict[tuple[int, int], list[tuple[int, dict]]] = defaultdict(list)
+
+    def _band_keys(self, fingerprint: int) -> List[tuple[int, int]]:
+        width = 64 // self.BANDS
+        return [(band, (fingerprint >> (band * width)) & ((1 << width) - 1)) for band in range(self.BANDS)]
+
+    def claim(self, url: str, content: str) -> Optional[dict]:
+        """Registers a page, or returns the entry of the page it duplicates if we have already seen it."""
+        canonical = canonicalize_url(url)
+        fingerprint = simhash(content) if content else None
+        with self._lock:
+            # 1. Cheap check first: the same page under a different address.
+            if canonical in self._by_url:
+                self.url_duplicates += 1
+                return self._by_url[canonical]
+
+            # 2. Then content: any fingerprint sharing a band is a candidate, confirmed by Hamming distance.
+            if fingerprint is not None:
+                for key in self._band_keys(fingerprint):
+                    for other, entry in self._bands[key]:
+                        if bin(fingerprint ^ other).count("1") <= self.max_distance:
+                            self.content_duplicates += 1
+                            self._by_url[canonical] = entry
+                            return entry
+
+            # 3. A new page: register it so later copies resolve to this one.
+            entry = {"url": url, "summary": None}
+            self._by_url[canonical] = entry
+            if fingerprint is not None:
+                for key in self._band_keys(fingerprint):
+                    self._bands[key].append((fingerprint, entry))
+            return None
+
+    def record_summary(self, url: str, summary: str) -> None:
+        """Attaches a finished summary to a page, so its duplicates can reuse it."""
+        with self._lock:
+            entry = self._by_url.get(canonicalize_url(url))
+            if entry is not None and entry["summary"] is None:
+                entry["summary"] = summary
+
+@dataclass
+class ResearchRun:
+    """State shared by every researcher in one deep-research run."""
+    run_id: str
+    dedup_index: NearDuplicateIndex = field(default_factory=NearDuplicateIndex)
+    # These are defined further below, with the search result caches and the researcher governor, hence the lazy defaults.
+    search_cache: "SearchResultCache" = field(default_factory=lambda: SearchResultCache())
+    researcher_governor: "ResearchGovernor" = field(default_factory=lambda: ResearchGovernor(max_concurrent_researchers))
+
+# LangGraph runs nodes as tasks that inherit the caller's context, so a run set here is visible to every researcher.
+current_research_run: ContextVar[Optional[ResearchRun]] = ContextVar("current_research_run", default=None)
+default_research_run: Optional[ResearchRun] = None
+
+@contextmanager
+def research_run(run_id: Optional[str] = None):
+    """Scopes run-level shared state (like the duplicate index) to everything executed inside the block."""
+    token = current_research_run.set(ResearchRun(run_id=run_id or uuid.uuid4().hex))
+    try:
+        yield current_research_run.get()
+    finally:
+        current_research_run.reset(token)
+
+def get_research_run() -> ResearchRun:
+    """The active research run; outside a research_run block, a single default run is shared."""
+    global default_research_run
+    run = current_research_run.get()
+    if run is None:
+        if default_research_run is None:
+            default_research_run = ResearchRun(run_id="default")
+        run = default_research_run
+    return run
+
+def resolve_duplicate(result: dict, index: NearDuplicateIndex, seen: set) -> Optional[dict]:
+    """Decides what to do with one search result given the run's index; `seen` holds the URLs already kept by this search."""
+    original = index.claim(result['url'], result.get('raw_content') or "")
+    if original is None:
+        seen.add(result['url'])
+        return result
+    if original["url"] in seen or result['url'] in seen:
+        # A duplicate within this very search adds nothing.
+        return None
+    seen.add(result['url'])
+    if original["summary"]:
+        # Already summarized earlier in the run: reuse that summary instead of calling the LLM again.
+        return {**result, "raw_content": None, "content": original["summary"]}
+    # Seen before but not summarized (yet): keep the source, but only with its snippet.
+    return {**result, "raw_content": None}
+
+def remember_summaries(unique_results: dict, summarized_results: dict) -> None:
+    """Records the summaries of freshly summarized pages in the run's index, for their duplicates to reuse."""
+    index = get_research_run().dedup_index
+    for url, result in summarized_results.items():
+        if unique_results.get(url, {}).get("raw_content"):
+            index.record_summary(url, result['content'])
+
+# %% [markdown]
+# SimHash gives every page a 64-bit fingerprint. A few changed words (a different byline, a syndication footer, an ad slot) only flip a few bits, so "near-duplicate" becomes "fingerprints within `SIMHASH_MAX_DISTANCE` bits". By splitting the fingerprint into four 16-bit bands, we only compare a page against candidates that share at least one band exactly, instead of against every page seen so far.
+# 
+# The index lives on a `ResearchRun`, which we scope with the `research_run()` context manager. Everything executed inside the block, including every parallel researcher the supervisor launches, shares one index. Outside of a block, a single default run is used, so deduplication still works across researchers in an ad-hoc session.
+# 
+# 1.  A duplicate **within** a single search is simply dropped.
+# 2.  A duplicate of a page that was **already summarized** earlier in the run reuses that summary, so redundant content is summarized exactly once.
+# 3.  A duplicate of a page that is still being summarized, or was filtered, keeps only its snippet. The source is not lost, but it costs no extra LLM call.
+# 
 # Finally, we can wrap this entire pipeline into our decorated `tavily_search` tool.
 
 # %%
@@ -1252,16 +2127,484 @@ def tavily_search(
     # 2. Deduplicate the results.
     unique_results = deduplicate_search_results(search_results)
 
-    # 3. Process and summarize the content.
+    # 3. Drop or downgrade pages that are not worth an LLM call.
+    unique_results = prefilter_search_results(unique_results, query)
+
+    # 4. Process and summarize the content.
     summarized_results = process_search_results(unique_results)
 
-    # 4. Format the final output.
+    # 5. Share the new summaries with the rest of the research run.
+    remember_summaries(unique_results, summarized_results)
+
+    # 6. Format the final output.
     return format_search_output(summarized_results)
 
 # %% [markdown]
 # The decorated `tavily_search` tool is the final, clean interface that our research agent will interact with.
 # 
-# It completely abstracts away the complex, multi-step **"Search -> Deduplicate -> Summarize -> Format"** pipeline we've just built. The agent simply calls this tool with a query, and it receives a perfectly formatted, dense, and relevant block of evidence in return.
+# It completely abstracts away the complex, multi-step **"Search -> Deduplicate -> Filter -> Summarize -> Format"** pipeline we've just built. The agent simply calls this tool with a query, and it receives a perfectly formatted, dense, and relevant block of evidence in return.
+# 
+# But each stage of this pipeline is a **barrier**. Nothing is summarized until every search has returned, and nothing is formatted until the slowest page has been summarized. A single long page holds back every other source, and the agent sees nothing at all until the very end.
+# 
+# The stages don't need to be barriers. Every source can flow through deduplication, filtering and summarization on its own, and be emitted the moment it is ready. So let's rebuild the pipeline as an async iterator.
+
+# %%
+from typing import AsyncIterator
+
+SEARCH_MAX_SOURCES = 2  # Sources the researcher waits for per search; None waits for every source
+
+async def stream_search_sources(
+    search_queries: List[str],
+    max_results: int = 3,
+    topic: Literal["general", "news", "finance"] = "general",
+) -> AsyncIterator[dict]:
+    """Runs Search -> Deduplicate -> Filter -> Summarize per source, yielding each source as soon as it is summarized."""
+    index = get_research_run().dedup_index
+    seen = set()
+    finished: asyncio.Queue = asyncio.Queue()
+    pending = set()
+
+    def spawn(coro) -> None:
+        # Every stage runs as its own task and reports to 'finished' the moment it is done.
+        task = asyncio.ensure_future(coro)
+        pending.add(task)
+        task.add_done_callback(finished.put_nowait)
+
+    async def summarize_source(url: str, result: dict) -> dict:
+        summarized = await process_search_results_async({url: result})
+        remember_summaries({url: result}, summarized)
+        return {"url": url, **summarized[url]}
+
+    async def search(query: str) -> None:
+        # 1. As soon as one query returns, its sources start moving; other queries may still be in flight.
+        response = await cached_search_async(query, max_results=max_results, topic=topic)
+        for result in response['results']:
+            # 2. Deduplicate and filter each source individually, then summarize it in its own task.
+            resolved = resolve_duplicate(result, index, seen)
+            if resolved is None:
+                continue
+            for url, kept in prefilter_search_results({result['url']: resolved}, query).items():
+                spawn(summarize_source(url, kept))
+
+    for query in search_queries:
+        spawn(search(query))
+
+    try:
+        while pending:
+            task = await finished.get()
+            pending.discard(task)
+            if task.cancelled() or task.exception() is not None:
+                print(f"Search pipeline step failed: {task.exception() if not task.cancelled() else 'cancelled'}")
+            elif task.result() is not None:
+                yield task.result()
+    finally:
+        # 3. If the caller stops early, we cancel the searches and summaries it no longer needs.
+        for task in pending:
+            task.cancel()
+
+async def stream_search_output(
+    search_queries: List[str],
+    max_results: int = 3,
+    topic: Literal["general", "news", "finance"] = "general",
+    max_sources: Optional[int] = SEARCH_MAX_SOURCES,
+) -> AsyncIterator[str]:
+    """The incremental formatter: yields each formatted source block as it arrives, stopping after max_sources."""
+    count = 0
+    sources = stream_search_sources(search_queries, max_results=max_results, topic=topic)
+    try:
+        async for source in sources:
+            count += 1
+            yield ("Search results: \n\n" if count == 1 else "") + format_search_source(count, source["url"], source)
+            if max_sources and count >= max_sources:
+                break
+    finally:
+        await sources.aclose()
+    if count == 0:
+        yield "No valid search results found."
+
+def get_partial_result_writer():
+    """LangGraph's custom stream writer when running inside a graph, or a no-op outside of one."""
+    try:
+        from langgraph.config import get_stream_writer
+        return get_stream_writer()
+    except Exception:
+        return lambda chunk: None
+
+async def atavily_search(
+    query: str,
+    max_results: int = 3,
+    topic: Literal["general", "news", "finance"] = "general",
+) -> str:
+    """The async implementation of tavily_search: streams sources to the graph as they complete, then returns them all."""
+    write_partial = get_partial_result_writer()
+    chunks = []
+    # SEARCH_MAX_SOURCES is read on every call, so changing it takes effect without redefining the tool.
+    async for chunk in stream_search_output([query], max_results=max_results, topic=topic, max_sources=SEARCH_MAX_SOURCES):
+        chunks.append(chunk)
+        # Callers streaming with stream_mode="custom" see each source the moment it is ready.
+        write_partial({"tool": "tavily_search", "query": query, "partial_result": chunk})
+    return "".join(chunks)
+
+# We keep the synchronous pipeline for 'invoke' and attach the streaming one for 'ainvoke'.
+tavily_search.coroutine = atavily_search
+
+# The researcher tools were bound before this pipeline existed, so we rebind them to use it.
+researcher_tools = [think_tool, tavily_search]
+model_with_tools = model.bind_tools(researcher_tools)
+tools_by_name = {tool.name: tool for tool in researcher_tools}
+
+# %% [markdown]
+# `stream_search_sources` turns the pipeline inside out. Instead of four batch stages, every search and every summary is an independent task, and sources are yielded in the order they **finish**:
+# 
+# 1.  A short page that summarizes in two seconds reaches the agent in two seconds, even if a long page next to it takes thirty. Time-to-first-evidence is now the time of the fastest source, not the slowest.
+# 2.  `stream_search_output` is the incremental formatter. It produces exactly the same `SOURCE n` blocks as `format_search_output`, one at a time, and stops after `max_sources` if the caller already has enough. Stopping early cancels the remaining work instead of letting it run in the background. `atavily_search` passes `SEARCH_MAX_SOURCES`, so by default a researcher moves on with the two fastest sources of a three-result search instead of waiting for the slowest page. Set it to `None` to wait for every source.
+# 3.  Inside a LangGraph run, `atavily_search` also pushes each block through the graph's custom stream, so `agent.astream(..., stream_mode="custom")` shows evidence as it arrives.
+# 
+# The synchronous `tavily_search` pipeline is still there for `invoke`; `ainvoke` now takes the streaming path. We also rebind `researcher_tools` here, because the tools bound at the top of the notebook were created before this pipeline existed.
+# 
+# So far, every search goes straight to Tavily. Without network access or an API key, the only fallback is a mock tool that returns a placeholder string, so the agent can't really research anything.
+# 
+# That makes the agent hard to benchmark. Search latency and results change from run to run, and load tests burn API credits. What we want is a **search provider interface** that the pipeline builds on, with two backends:
+# 
+# 1.  `TavilySearchProvider`, the web search we have been using so far.
+# 2.  `LocalCorpusSearchProvider`, a BM25 index over a directory of documents on disk. It returns results in exactly Tavily's format, so the full research graph runs offline and reproducibly.
+
+# %%
+import heapq
+import html
+import math
+import os
+from abc import ABC, abstractmethod
+from collections import Counter
+from pathlib import Path
+
+# Search backend settings
+SEARCH_PROVIDER = "tavily"           # "tavily" for web search, "local" for the offline corpus
+LOCAL_CORPUS_DIR = "corpus"          # Directory of .txt, .md and .html documents for the local backend
+LOCAL_SEARCH_LATENCY = 0.0           # Seconds of simulated latency per local query, to mimic a real API in benchmarks
+
+class SearchProvider(ABC):
+    """A search backend that returns Tavily-shaped responses: {"query": ..., "results": [{url, title, content, raw_content, score}]}."""
+    name: str = "base"
+
+    @abstractmethod
+    def search(self, query: str, max_results: int = 3, topic: str = "general", include_raw_content: bool = True) -> dict:
+        """Runs one query synchronously."""
+
+    async def asearch(self, query: str, max_results: int = 3, topic: str = "general", include_raw_content: bool = True) -> dict:
+        """Runs one query without blocking the event loop; backends with a native async client override this."""
+        return await asyncio.to_thread(self.search, query, max_results, topic, include_raw_content)
+
+class TavilySearchProvider(SearchProvider):
+    """Web search through the Tavily API, using the sync client for 'search' and the pooled HTTP client for 'asearch'."""
+    name = "tavily"
+
+    def __init__(self, api_key: str):
+        # Imported here, so the offline backend works without the tavily package installed.
+        from tavily import TavilyClient
+        self.client = TavilyClient(api_key=api_key)
+
+        # One pooled HTTP client shared by every async search, so connections to Tavily are reused across queries and researchers.
+        self.http = httpx.AsyncClient(
+            base_url="https://api.tavily.com",
+            headers={"Authorization": f"Bearer {api_key}"},
+            limits=httpx.Limits(max_connections=SEARCH_CONCURRENCY, max_keepalive_connections=SEARCH_CONCURRENCY),
+            timeout=SEARCH_TIMEOUT,
+        )
+
+    def search(self, query: str, max_results: int = 3, topic: str = "general", include_raw_content: bool = True) -> dict:
+        return self.client.search(query, max_results=max_results, include_raw_content=include_raw_content, topic=topic)
+
+    async def asearch(self, query: str, max_results: int = 3, topic: str = "general", include_raw_content: bool = True) -> dict:
+        payload = {"query": query, "max_results": max_results, "topic": topic, "include_raw_content": include_raw_content}
+        response = await self.http.post("/search", json=payload)
+        response.raise_for_status()
+        return response.json()
+
+class LocalCorpusSearchProvider(SearchProvider):
+    """Offline search over a directory of documents, ranked with BM25."""
+    name = "local"
+    EXTENSIONS = {".txt", ".md", ".markdown", ".html", ".htm"}
+
+    def __init__(self, directory: str, k1: float = 1.5, b: float = 0.75, latency: float = 0.0):
+        self.k1 = k1
+        self.b = b
+        self.latency = latency
+        self.documents: List[dict] = []
+        self.doc_lengths: List[int] = []
+        self.postings: dict[str, List[tuple[int, int]]] = defaultdict(list)
+
+        # 1. We index every document once, up front: term -> [(document id, term frequency)].
+        for path in sorted(Path(directory).rglob("*")):
+            if not path.is_file() or path.suffix.lower() not in self.EXTENSIONS:
+                continue
+            text = path.read_text(encoding="utf-8", errors="ignore")
+            if path.suffix.lower() in (".html", ".htm"):
+                text = self.html_to_text(text)
+            tokens = self.tokenize(text)
+            doc_id = len(self.documents)
+            for term, frequency in Counter(tokens).items():
+                self.postings[term].append((doc_id, frequency))
+            self.doc_lengths.append(len(tokens))
+            first_line = next((line.strip() for line in text.splitlines() if line.strip()), path.stem)
+            self.documents.append({"url": path.resolve().as_uri(), "title": first_line.lstrip("# ")[:120], "text": text})
+        self.avg_length = sum(self.doc_lengths) / len(self.doc_lengths) if self.doc_lengths else 1.0
+        print(f"✓ Local corpus indexed: {len(self.documents)} documents, {len(self.postings)} terms")
+
+    @staticmethod
+    def html_to_text(markup: str) -> str:
+        markup = re.sub(r"(?is)<(script|style)[^>]*>.*?</\1>", " ", markup)
+        markup = re.sub(r"(?i)</(p|div|h[1-6]|li|title|tr)>|<br\s*/?>", "\n", markup)
+        text = html.unescape(re.sub(r"(?s)<[^>]+>", " ", markup))
+        return "\n".join(line.strip() for line in text.splitlines() if line.strip())
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return [w for w in WORD_PATTERN.findall(text.lower()) if w not in STOPWORDS]
+
+    @staticmethod
+    def snippet(text: str, terms: set, length: int = 500) -> str:
+        """A short excerpt around the first query term, standing in for Tavily's 'content' snippet."""
+        lowered = text.lower()
+        positions = [p for p in (lowered.find(term) for term in terms) if p >= 0]
+        start = max(0, min(positions) - length // 4) if positions else 0
+        return " ".join(text[start:start + length].split())
+
+    def rank(self, query: str, max_results: int, include_raw_content: bool) -> dict:
+        # 2. BM25: idf-weighted term frequency, saturated by k1 and normalized by document length with b.
+        terms = set(self.tokenize(query))
+        scores = defaultdict(float)
+        total = len(self.documents)
+        for term in terms:
+            postings = self.postings.get(term, [])
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings:
+                norm = frequency + self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / self.avg_length)
+                scores[doc_id] += idf * frequency * (self.k1 + 1) / norm
+
+        results = []
+        for doc_id, score in heapq.nlargest(max_results, scores.items(), key=lambda item: item[1]):
+            document = self.documents[doc_id]
+            results.append({
+                "url": document["url"],
+                "title": document["title"],
+                "content": self.snippet(document["text"], terms),
+                "raw_content": document["text"] if include_raw_content else None,
+                "score": round(score, 4),
+            })
+        return {"query": query, "results": results}
+
+    def search(self, query: str, max_results: int = 3, topic: str = "general", include_raw_content: bool = True) -> dict:
+        # The corpus has no topics, so 'topic' is accepted for compatibility and ignored.
+        if self.latency:
+            time.sleep(self.latency)
+        return self.rank(query, max_results, include_raw_content)
+
+    async def asearch(self, query: str, max_results: int = 3, topic: str = "general", include_raw_content: bool = True) -> dict:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return await asyncio.to_thread(self.rank, query, max_results, include_raw_content)
+
+def create_search_provider(name: str) -> SearchProvider:
+    """Builds the configured search backend."""
+    if name == "local":
+        return LocalCorpusSearchProvider(LOCAL_CORPUS_DIR, latency=LOCAL_SEARCH_LATENCY)
+
+    # The key only comes from the environment; offline mode never needs it.
+    api_key = os.environ.get("TAVILY_API_KEY")
+    if not api_key:
+        raise ValueError('TAVILY_API_KEY is not set. Export it, or set SEARCH_PROVIDER = "local" to search the offline corpus.')
+    return TavilySearchProvider(api_key)
+
+search_provider = create_search_provider(SEARCH_PROVIDER)
+
+# %% [markdown]
+# Both search entry points already go through `search_provider`. `tavily_search_multiple` keeps its name and signature, since the rest of the pipeline calls it, but it searches whichever backend is configured. `tavily_search_async` keeps its semaphore, timeout and retry logic, and only delegates the request itself.
+# 
+# Switching the whole agent to offline mode is now a one-line change: set `SEARCH_PROVIDER = "local"` and point `LOCAL_CORPUS_DIR` at a folder of documents. The Tavily clients are only built by `create_search_provider("tavily")`, with the key read from `TAVILY_API_KEY`, so offline mode needs neither the key nor the `tavily` package.
+# 
+# 1.  The BM25 index is built once, when the provider is created, so each query is a handful of dictionary lookups. Local search is effectively free, which isolates the LLM's share of end-to-end latency.
+# 2.  `LOCAL_SEARCH_LATENCY` adds a fixed delay per query. This lets a load test reproduce a realistic API round trip without touching the network.
+# 3.  Results come back in Tavily's shape, with `url`, `title`, `content` and `raw_content`. Deduplication, filtering, summarization and caching all behave exactly as they do with web search.
+# 
+# The summary cache saves us from summarizing the same page twice, but not from **searching** twice. Parallel researchers working on related sub-topics routinely ask the same question, and across supervisor iterations they ask it again in slightly different words ("TSMC Arizona fab", "Arizona fab of TSMC"). Every one of those is a full API round trip.
+# 
+# So we put a query-result cache in front of the provider, at two levels:
+# 
+# 1.  A **run cache** on `ResearchRun`, shared by every researcher in one deep-research run. It also coalesces in-flight queries, so two researchers asking the same thing at the same moment share one search.
+# 2.  A **process cache** with a size limit and a TTL, which carries results across runs.
+# 
+# Queries are keyed by their normalized form (lowercased, stopwords dropped, terms sorted), together with `topic` and `max_results`. The exact key never changes a word, so "AI news" and "new AI" stay different questions. A query that misses exactly is looked up again by its **signature**: the same terms with plurals reduced to singulars, so "TSMC Arizona factories" can reuse "the Arizona factory of TSMC". That fuzzy match is deliberately narrow:
+# 
+# 1.  Only plural endings are removed, never endings like "-er" or "-ing" that change the word ("computer chips" is not "computing chips"), and a word whose stem would be shorter than `MIN_STEM_LENGTH` is kept whole ("AIDS" is not "aid").
+# 2.  The two normalized queries must also share at least `SEARCH_CACHE_MIN_SIMILARITY` of their character trigrams, so one ending can't flip a short query.
+# 3.  The content terms themselves must match: "TSMC Arizona fab" never reuses "Intel Arizona fab", and numbers are compared verbatim, since "revenue 2024" and "revenue 2025" are different questions.
+# 
+# Every hit is printed, and similar hits show the query they reused, so cache reuse shows up in the trace.
+# 
+# `tavily_search_multiple` already looks every query up in these caches before searching. `cached_search_async` does the same for `tavily_search_async`, which keeps its semaphore, timeout and retries, and the streaming search pipeline calls the cached version.
+
+# %%
+from collections import OrderedDict
+
+SEARCH_CACHE_MAX_ENTRIES = 1000  # Process-wide cache size; the least recently used entries are dropped first
+SEARCH_CACHE_TTL = 3600.0        # Seconds a process-wide result stays fresh (run caches live as long as their run)
+SEARCH_CACHE_MIN_SIMILARITY = 0.6 # Minimum character-trigram Jaccard similarity for reusing a reworded query
+MIN_STEM_LENGTH = 4              # Shorter stems are ambiguous ('news' vs 'new', 'aids' vs 'aid'), so such words are kept whole
+
+def normalize_query(query: str) -> str:
+    """Lowercases the query, drops stopwords and sorts the terms, so word order and filler words don't matter."""
+    return " ".join(sorted(set(WORD_PATTERN.findall(query.lower())) - STOPWORDS))
+
+def stem_term(term: str) -> str:
+    """Reduces a plural to its singular ('companies' -> 'company', 'taxes' -> 'tax'), unless the stem would be too short to be unambiguous."""
+    if term.endswith("ies"):
+        stem = term[:-3] + "y"
+    elif term.endswith(("sses", "xes", "ches", "shes", "zes")):
+        stem = term[:-2]
+    elif term.endswith("s") and not term.endswith(("ss", "us", "is")):
+        stem = term[:-1]
+    else:
+        return term
+    return stem if len(stem) >= MIN_STEM_LENGTH else term
+
+def query_similarity(a: str, b: str) -> float:
+    """Jaccard similarity of the character trigrams of two normalized queries."""
+    grams_a, grams_b = ({text[i:i + 3] for i in range(len(text) - 2)} for text in (f" {a} ", f" {b} "))
+    return len(grams_a & grams_b) / len(grams_a | grams_b) if grams_a | grams_b else 0.0
+
+def query_signature(normalized: str) -> tuple:
+    """The stemmed content terms of a normalized query. Years, quarters and model numbers are kept verbatim, since they change what a query asks for."""
+    return tuple(sorted({term if any(c.isdigit() for c in term) else stem_term(term) for term in normalized.split()}))
+
+class SearchResultCache:
+    """Search responses keyed by normalized query, topic and result count, with a plural-insensitive signature for reworded queries."""
+
+    def __init__(self, max_entries: Optional[int] = None, ttl_seconds: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.inflight: dict[tuple, asyncio.Task] = {}
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple, tuple[float, str, dict]] = OrderedDict()
+        self._signatures: dict[tuple, tuple] = {}
+
+    @staticmethod
+    def key(query: str, max_results: int, topic: str, include_raw_content: bool) -> tuple:
+        # Responses with and without raw content are not interchangeable, so that flag is part of the key too.
+        return (normalize_query(query), topic, max_results, include_raw_content)
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - stored_at > self.ttl_seconds
+
+    @staticmethod
+    def _signature_key(key: tuple) -> tuple:
+        return (query_signature(key[0]), *key[1:])
+
+    def get(self, key: tuple) -> Optional[tuple[dict, str, str]]:
+        """Returns (response, 'exact' or 'similar', the query that produced it), or None on a miss."""
+        with self._lock:
+            # 1. Exact match on the normalized key.
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry[0]):
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry[2], "exact", entry[1]
+
+            # 2. Otherwise an earlier query with the same terms up to plurals, the same topic and result count,
+            #    and enough characters in common that a short query can't be changed by a single ending.
+            similar = self._signatures.get(self._signature_key(key))
+            entry = self._entries.get(similar) if similar is not None else None
+            if entry is not None and not self._expired(entry[0]) and query_similarity(key[0], similar[0]) >= SEARCH_CACHE_MIN_SIMILARITY:
+                self._entries.move_to_end(similar)
+                self.similar_hits += 1
+                return entry[2], "similar", entry[1]
+
+            self.misses += 1
+            return None
+
+    def put(self, key: tuple, query: str, response: dict) -> None:
+        with self._lock:
+            self._entries[key] = (time.time(), query, response)
+            self._entries.move_to_end(key)
+            self._signatures[self._signature_key(key)] = key
+            while self.max_entries is not None and len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                if self._signatures.get(self._signature_key(evicted)) == evicted:
+                    del self._signatures[self._signature_key(evicted)]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.exact_hits + self.similar_hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.exact_hits + self.similar_hits) / lookups, 3) if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+process_search_cache = SearchResultCache(max_entries=SEARCH_CACHE_MAX_ENTRIES, ttl_seconds=SEARCH_CACHE_TTL)
+
+def lookup_search_cache(key: tuple, query: str) -> Optional[dict]:
+    """Checks the run cache, then the process cache, and reports any hit in the trace."""
+    run_cache = get_research_run().search_cache
+    for scope, cache in (("run", run_cache), ("process", process_search_cache)):
+        hit = cache.get(key)
+        if hit is None:
+            continue
+        response, match, original_query = hit
+        if cache is not run_cache:
+            run_cache.put(key, original_query, response)
+        print(f"♻ Search cache hit ({scope}, {match}): '{query}'" + (f" ≈ '{original_query}'" if match == "similar" else ""))
+        return {**response, "query": query}
+    return None
+
+def store_search_result(key: tuple, query: str, response: dict) -> None:
+    # An empty response is usually a failure, and caching it would hide the query from a later retry.
+    if response["results"]:
+        get_research_run().search_cache.put(key, query, response)
+        process_search_cache.put(key, query, response)
+
+async def cached_search_async(
+    query: str,
+    max_results: int = 3,
+    topic: Literal["general", "news", "finance"] = "general",
+    include_raw_content: bool = True,
+) -> dict:
+    """Runs a single query through the search caches, falling back to tavily_search_async on a miss."""
+    key = SearchResultCache.key(query, max_results, topic, include_raw_content)
+    cached = lookup_search_cache(key, query)
+    if cached is not None:
+        return cached
+
+    # 1. If another researcher is already running this exact query, we wait for its result instead of searching again.
+    run_cache = get_research_run().search_cache
+    task = run_cache.inflight.get(key)
+    if task is not None:
+        print(f"♻ Search in flight, sharing result: '{query}'")
+    else:
+        async def search_and_store() -> dict:
+            response = await tavily_search_async(query, max_results=max_results, topic=topic, include_raw_content=include_raw_content)
+            store_search_result(key, query, response)
+            return response
+
+        task = asyncio.ensure_future(search_and_store())
+        run_cache.inflight[key] = task
+        task.add_done_callback(lambda _: run_cache.inflight.pop(key, None))
+
+    # 2. Shielded, so a cancelled caller doesn't cancel a search other researchers are waiting on.
+    return {**await asyncio.shield(task), "query": query}
+
+# %% [markdown]
+# Two details keep the cache honest:
+# 
+# 1.  Results from the cache still go through deduplication. A page another researcher has already summarized in this run is reused through its summary instead of being summarized again.
+# 2.  `process_search_cache.stats()` and `get_research_run().search_cache.stats()` report exact and similar hits separately. If similar hits look wrong for your queries, raise `SEARCH_CACHE_MIN_SIMILARITY`.
 # 
 # ### Compressing the Findings
 # 
@@ -1389,30 +2732,36 @@ Critical Reminder: It is extremely important that any information that is even r
 # Compress model
 compress_model = init_chat_model(model="gpt-oss:20b", base_url="http://localhost:11434", max_tokens=32000)
 
-def compress_research(state: ResearcherState) -> dict:
+async def compress_research(state: ResearcherState) -> dict:
     """The final node in the research sub-graph: it compresses all findings from the ReAct loop into a clean, cited summary."""
+    history = state.get("researcher_messages", [])
+    summary = state.get("research_summary", "")
+    compressed_through = state.get("compressed_through", 0)
+
     # 1. We format the system and human messages for our compression model.
     system_message = compress_research_system_prompt.format(date=get_today_str())
 
-    # The full message history of the ReAct loop is passed as context.
-    messages = [SystemMessage(content=system_message)] + state.get("researcher_messages", []) + [HumanMessage(content=compress_research_human_message.format(research_topic=state['research_topic']))]
+    # The running summary kept by the 'compress_step' node (defined below) stands in for the history it covers,
+    # so we only finish it off with the messages after the last step.
+    context = []
+    if summary:
+        context.append(HumanMessage(content=f"Running summary of the earlier research steps:\n\n{summary}"))
+    delta = history[compressed_through:] if summary else history
+    messages = [SystemMessage(content=system_message)] + context + list(delta) + [HumanMessage(content=compress_research_human_message.format(research_topic=state['research_topic']))]
     
     # 2. We invoke our powerful 'compress_model'.
-    response = compress_model.invoke(messages)
+    #    This is the longest single call a researcher makes, so we await it rather than hold up the event loop.
+    response = await compress_model.ainvoke(messages)
 
     # 3. We also extract the raw, unprocessed notes from the tool and AI messages.
     #    This is for archival purposes and can be used by the Supervisor for deeper analysis if needed.
-    raw_notes = [
-        str(m.content) for m in filter_messages(
-            state["researcher_messages"], 
-            include_types=["tool", "ai"] # We only include the 'action' and 'observation' parts of the loop.
-        )
-    ]
+    #    Earlier steps already contributed their raw notes, think-only steps included, so we only add the remainder.
+    remainder = raw_notes_for(history[compressed_through:])
 
     # 4. This node returns the final, clean outputs that will be passed out of the sub-graph.
     return {
         "compressed_research": str(response.content),
-        "raw_notes": ["\n".join(raw_notes)]
+        "raw_notes": [remainder] if remainder else [],
     }
 
 # %% [markdown]
@@ -1421,17 +2770,194 @@ def compress_research(state: ResearcherState) -> dict:
 # 1.  It acts as the bridge between the chaotic, internal process of the research agent and the clean, structured information that the Supervisor expects.
 # 2.  It takes the entire messy history of the ReAct loop, filters out the internal monologue, and produces two key artifacts, the `compressed_research` summary for the Supervisor's immediate use, and the `raw_notes` for deeper, optional analysis. This separation of concerns is a key pattern for building clean interfaces between different agentic components.
 # 
+# Notice that every node and tool of the researcher is async. The Supervisor will run several researchers at once with `asyncio.gather`, and a synchronous node calling `.invoke` would block. LangGraph runs such a node in a worker thread, so the researchers would only overlap as far as the thread pool lets them.
+# 
+# 1.  `llm_call` and `compress_research` await `ainvoke` on their models, so a researcher waiting on Ollama gives the event loop back to the others.
+# 2.  `think_tool` has a coroutine, so `tool_node` never leaves the event loop. `tavily_search` has one from the streaming pipeline, and the summary cache reads and writes SQLite in a worker thread through `aget` and `aput`.
+# 3.  With every step async, `max_concurrent_researchers` researchers really do overlap their LLM and network waits.
+# 
 # Finally, we can assemble all these components into our complete, runnable `researcher_agent` sub-graph.
 
+# %% [markdown]
+# There is still one step whose cost grows with the length of the research loop: `compress_research`. Given the entire `researcher_messages` history, it would re-read every search result of every turn in one huge prompt at the very end. A researcher that ran five search turns would pay for all five again in a single call, and nothing else could happen while it did.
+# 
+# So the researcher compresses **incrementally**:
+# 
+# 1.  A new `compress_step` node runs after every `tool_node` step. It folds only the messages added since the last step into a single running summary, `research_summary`. Its prompt asks for a dense, cited summary rather than a verbatim copy, and its model has a small output cap, so the summary stays roughly the same size however many steps it covers.
+# 2.  It runs in parallel with the next `llm_call`, in the same LangGraph superstep, so the loop does not wait for it before starting the next turn. It is not free, though. `compress_step` and `llm_call` share one Ollama server, so the two calls compete for it, and LangGraph finishes the whole superstep before moving on. A step costs the longer of the two calls plus the contention between them, which is still far less than one huge compression at the end. It also means that by the time `compress_research` runs, every step has been compressed.
+# 3.  That is why `compress_research` above only finishes off the running summary with the last, uncompressed part of the history. Each call's input is bounded by the summary plus one step's worth of results, not by the raw history.
+# 4.  `raw_notes` is built the same way, one entry per step, instead of joining the full history at the end.
+# 5.  A step whose compression fails leaves `compressed_through` where it was. Its messages are simply folded in by the next step, or by `compress_research`, instead of crashing the researcher.
+
+# %%
+STEP_SUMMARY_MAX_WORDS = 1200    # Target length of the running summary
+STEP_SUMMARY_MAX_TOKENS = 4000   # Output cap for one step, leaving room for the model's reasoning
+
+# The running summary is rewritten on every step, so its model gets a much smaller output cap than compress_model.
+step_compress_model = init_chat_model(model="gpt-oss:20b", base_url="http://localhost:11434", max_tokens=STEP_SUMMARY_MAX_TOKENS)
+
+rolling_summary_system_prompt = """You maintain the running summary of a research agent's findings. For context, today's date is {date}.
+
+<Task>
+You are given the messages from the agent's latest research step, followed by the running summary so far.
+Rewrite the summary so that it also covers the new findings, and output the complete updated summary.
+</Task>
+
+<Guidelines>
+1. Keep every fact, figure, date and name that is relevant to the research topic, and cite each one with its source URL in brackets.
+2. Merge new findings into the existing summary instead of appending them, so each fact is stated once.
+3. Ignore the agent's think_tool reflections. Only externally sourced information belongs in the summary.
+4. Be dense: no introduction, no conclusion, no filler. Stay under {max_words} words.
+</Guidelines>
+"""
+
+rolling_summary_human_message = """Research topic: {research_topic}
+
+Running summary so far:
+{summary}
+
+Update the running summary with the findings from the research step above."""
+
+def raw_notes_for(messages: Sequence[BaseMessage]) -> str:
+    return "\n".join(str(m.content) for m in filter_messages(messages, include_types=["tool", "ai"]))
+
+async def compress_step(state: ResearcherState) -> dict:
+    """Folds the messages added since the previous step into the running research summary."""
+    messages = state["researcher_messages"]
+    delta = messages[state.get("compressed_through", 0):]
+
+    # 1. A step that only called think_tool has no findings to compress, but its reasoning still goes into raw_notes.
+    tool_messages = [m for m in delta if isinstance(m, ToolMessage) and m.name != "think_tool"]
+    if not tool_messages:
+        return {"raw_notes": [raw_notes_for(delta)], "compressed_through": len(messages)}
+
+    # 2. The model sees the summary so far and this step's messages only, and rewrites the summary to cover both.
+    summary = state.get("research_summary") or "(nothing yet)"
+    try:
+        response = await step_compress_model.ainvoke(
+            [SystemMessage(content=rolling_summary_system_prompt.format(date=get_today_str(), max_words=STEP_SUMMARY_MAX_WORDS))]
+            + list(delta)
+            + [HumanMessage(content=rolling_summary_human_message.format(research_topic=state["research_topic"], summary=summary))]
+        )
+    except Exception as e:
+        # 3. Nothing is marked as compressed, so these messages are folded in by the next step or by compress_research.
+        print(f"⚠ Step compression failed, deferring it: {e}")
+        return {}
+
+    return {
+        "research_summary": str(response.content),
+        "raw_notes": [raw_notes_for(delta)],
+        "compressed_through": len(messages),
+    }
+
+# %% [markdown]
+# The running summary also fixes the other half of the problem. `llm_call` sends the system prompt plus the **full** `researcher_messages` history on every turn, so turn N re-reads every search result from turns 1 to N-1. Prompt tokens per turn grow linearly, the total over a loop grows quadratically, and on a local model that is all prefill time.
+# 
+# So `llm_call` works from a token-budgeted view of its history, built by `window_researcher_messages`:
+# 
+# 1.  The research topic and the last `RESEARCHER_VERBATIM_TURNS` turns are always kept exactly as they are. A turn is one `AIMessage` and the tool results that answer it.
+# 2.  In older turns, each search result already folded into `research_summary` is replaced by that summary. The `ToolMessage`s stay, so every tool call still has its answer, but only the first one carries the summary.
+# 3.  If the history is still over `RESEARCHER_CONTEXT_TOKENS`, the oldest turns are dropped as a whole until it fits.
+# 4.  `llm_call` records the prompt and completion tokens of every turn in `turn_token_usage`, using the model's own counts when it reports them and our estimate otherwise.
+
+# %%
+RESEARCHER_CONTEXT_TOKENS = 12000  # Prompt budget for one researcher turn, system prompt included
+RESEARCHER_VERBATIM_TURNS = 2      # Most recent turns that are always sent exactly as they are
+
+def estimate_message_tokens(message: BaseMessage) -> int:
+    return estimate_tokens(str(message.content) + str(getattr(message, "tool_calls", None) or ""))
+
+def window_researcher_messages(messages: Sequence[BaseMessage], summary: str, compressed_through: int, budget: int) -> List[BaseMessage]:
+    """Fits the researcher's history into a token budget: recent turns verbatim, older tool results as the running summary."""
+    # 1. Split the history into the opening topic message and turns that each start with an AIMessage.
+    head, turns = [], []
+    for message in messages:
+        if isinstance(message, AIMessage):
+            turns.append([message])
+        elif turns:
+            turns[-1].append(message)
+        else:
+            head.append(message)
+
+    # 2. In the older turns, search results already in the running summary are replaced by it, which is sent once.
+    covered = {id(m) for m in messages[:compressed_through]} if summary else set()
+    noted = False
+    split = max(len(turns) - RESEARCHER_VERBATIM_TURNS, 0)
+    older, recent = turns[:split], turns[split:]
+    compacted = []
+    for turn in older:
+        compacted_turn = []
+        for message in turn:
+            if isinstance(message, ToolMessage) and message.name != "think_tool" and id(message) in covered:
+                if noted:
+                    content = "[Included in the running research summary above.]"
+                else:
+                    noted = True
+                    content = f"[Running summary of the research so far]\n{summary}"
+                message = ToolMessage(content=content, name=message.name, tool_call_id=message.tool_call_id)
+            compacted_turn.append(message)
+        compacted.append(compacted_turn)
+
+    # 3. If that is still too long, we drop whole turns from the oldest, so no tool call loses its answer.
+    fixed = sum(estimate_message_tokens(m) for m in head + [m for turn in recent for m in turn])
+    sizes = [sum(estimate_message_tokens(m) for m in turn) for turn in compacted]
+    while compacted and fixed + sum(sizes) > budget:
+        compacted.pop(0)
+        sizes.pop(0)
+
+    return head + [m for turn in compacted + recent for m in turn]
+
+# %% [markdown]
+# The prompt's **Hard Limits** are only advice. Left to the prompt, `should_continue` would loop for as long as the model keeps asking for tools, so a researcher that doesn't take the hint would keep burning GPU time until the Supervisor gives up on it.
+# 
+# So the researcher nodes enforce the limits in the graph with a `ResearcherBudget`:
+# 
+# 1.  It caps tool-calling turns, individual tool calls, `tavily_search` calls, wall-clock time, and prompt and completion tokens. `tool_node` increments `tool_call_iterations` and counts searches, and `llm_call` records tokens. `tool_node` also caps every tool's timeout at the time left in the budget, so a slow search can't carry the researcher past `max_seconds`.
+# 2.  `llm_call` checks the budget before calling the model, so an exhausted researcher doesn't spend another turn. It checks again after the response, counting the tool calls the model just planned. If those would go over, the calls are dropped and the text of the response is kept.
+# 3.  Either way, the limit that fired is recorded in `budget_exhausted`, and `should_continue` routes straight to `compress_research`. The researcher still hands back everything it found.
+
+# %%
+@dataclass
+class ResearcherBudget:
+    """Hard limits for one researcher's ReAct loop."""
+    max_tool_iterations: int = 10    # Tool-calling turns: five searches, each followed by a think_tool reflection
+    max_tool_calls: int = 15         # Individual tool calls across all turns
+    max_search_calls: int = 5        # tavily_search calls, matching the prompt's hard limit
+    max_seconds: float = 300.0       # Wall-clock time since the researcher's first turn
+    max_prompt_tokens: int = 80000   # Prompt tokens summed over all turns
+    max_completion_tokens: int = 10000
+
+    def exhausted(self, state: dict, planned_calls: Sequence[dict] = ()) -> Optional[str]:
+        """The first limit the researcher has gone over, counting the tool calls it is about to make, or None."""
+        usage = state.get("turn_token_usage", [])
+        checks = [
+            ("max_tool_iterations", state.get("tool_call_iterations", 0) + (1 if planned_calls else 0), self.max_tool_iterations),
+            ("max_tool_calls", state.get("tool_calls", 0) + len(planned_calls), self.max_tool_calls),
+            ("max_search_calls", state.get("search_calls", 0) + sum(1 for call in planned_calls if call["name"] == "tavily_search"), self.max_search_calls),
+            ("max_seconds", time.time() - state.get("started_at", time.time()), self.max_seconds),
+            ("max_prompt_tokens", sum(turn["prompt_tokens"] for turn in usage), self.max_prompt_tokens),
+            ("max_completion_tokens", sum(turn["completion_tokens"] for turn in usage), self.max_completion_tokens),
+        ]
+        for name, used, limit in checks:
+            if used > limit:
+                return f"{name} ({used:.0f} > {limit:.0f})"
+        return None
+
+researcher_budget = ResearcherBudget()
+
+def budget_stop(state: ResearcherState, limit: str) -> None:
+    print(f"⛔ Researcher budget exhausted, compressing findings: {limit} — {state['research_topic'][:80]}")
+
 # %%
 from langgraph.graph import StateGraph, START, END
 
 # We initialize a new StateGraph, specifying the input state and, importantly, the output schema for this sub-graph.
 agent_builder = StateGraph(ResearcherState, output_schema=ResearcherOutputState)
 
-# We add our three nodes: the thinker (llm_call), the actor (tool_node), and the final compressor.
+# We add our four nodes: the thinker (llm_call), the actor (tool_node), the step compressor, and the final compressor.
 agent_builder.add_node("llm_call", llm_call)
 agent_builder.add_node("tool_node", tool_node)
+agent_builder.add_node("compress_step", compress_step)
 agent_builder.add_node("compress_research", compress_research)
 
 # The entry point for this sub-graph is always the 'llm_call' (the brain).
@@ -1450,6 +2976,10 @@ agent_builder.add_conditional_edges(
 # After the tool node acts, the flow loops back to the brain to process the results of the action.
 agent_builder.add_edge("tool_node", "llm_call")
 
+# In parallel with the brain, the new results are folded into the rolling compression; that branch ends there.
+agent_builder.add_edge("tool_node", "compress_step")
+agent_builder.add_edge("compress_step", END)
+
 # The compression node is the final step; its output is the output of the entire sub-graph, so we connect it to END.
 agent_builder.add_edge("compress_research", END)
 
@@ -1663,6 +3193,99 @@ def get_notes_from_tool_calls(messages: list[BaseMessage]) -> list[str]:
 # 
 # Now, we build the main `supervisor_tools` node. This is the most complex node in our entire system, as it orchestrates sub-graph execution, tool calls, and our self-evolution evaluation.
 
+# Before we do, one problem with that fan-out. The Supervisor can request as many `ConductResearch` calls in a single turn as it likes, and each one becomes a full researcher with its own LLM calls and searches. `max_concurrent_researchers` is only mentioned in the prompt, so nothing stops one turn from queuing a dozen researchers against a single local Ollama server.
+# 
+# So we add a small **admission governor**:
+# 
+# 1.  `ResearchGovernor` is a semaphore with a priority queue. Up to `limit` researchers run at once, and the rest wait in line, highest `priority` first and then in the order the Supervisor asked for them.
+# 2.  Each `ResearchRun` gets its own governor sized to `max_concurrent_researchers`, and a process-wide governor caps researchers across all runs sharing this Ollama backend.
+# 3.  `ConductResearch` carries an optional `priority`, so the Supervisor can say which topics matter most when it asks for more than can run at once.
+
+# %%
+import itertools
+from contextlib import asynccontextmanager
+
+PROCESS_MAX_RESEARCHERS = 4  # Maximum researchers running at once across every run in this process
+
+class ResearchGovernor:
+    """A concurrency limit that admits waiting researchers in priority order instead of first come, first served."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.peak = 0
+        self._waiting = []  # Heap of (-priority, arrival, future)
+        self._arrivals = itertools.count()
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for *_, future in self._waiting if not future.done())
+
+    async def acquire(self, priority: int = 0) -> None:
+        # 1. A free slot is taken immediately, unless someone is already waiting for one.
+        if self.active < self.limit and not self.queued:
+            self._admit()
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (-priority, next(self._arrivals), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # If the slot was handed over just as we were cancelled, we pass it on instead of leaking it.
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def _admit(self) -> None:
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+
+    def release(self) -> None:
+        # 2. A finishing researcher hands its slot straight to the highest-priority waiter that is still waiting.
+        self.active -= 1
+        while self._waiting:
+            *_, future = heapq.heappop(self._waiting)
+            if not future.done():
+                self._admit()
+                future.set_result(None)
+                return
+
+    @asynccontextmanager
+    async def slot(self, priority: int = 0):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+process_research_governor = ResearchGovernor(PROCESS_MAX_RESEARCHERS)
+
+async def conduct_research(tool_call: dict, run: ResearchRun) -> dict:
+    """Runs one researcher sub-graph once both the run and the process have a free slot."""
+    topic = tool_call["args"]["research_topic"]
+    priority = tool_call["args"].get("priority", 0)
+
+    # 3. Slots are always taken run first, then process, so two runs can never hold each other's slots.
+    governors = (run.researcher_governor, process_research_governor)
+    if any(governor.active >= governor.limit for governor in governors):
+        print(f"⏳ Research queued (priority {priority}): {topic[:80]}")
+    async with run.researcher_governor.slot(priority), process_research_governor.slot(priority):
+        return await researcher_agent.ainvoke({"researcher_messages": [HumanMessage(content=topic)], "research_topic": topic})
+
+async def run_research_calls(conduct_research_calls: list[dict]) -> list[dict]:
+    """Fans out every ConductResearch call under the governors; results come back in the order of the calls."""
+    run = get_research_run()
+
+    # 4. Tasks start in the order they are created and a free slot is taken at once, so we launch the calls
+    #    highest priority first (ties in call order). Otherwise the first calls would fill the free slots whatever their priority.
+    launch_order = sorted(range(len(conduct_research_calls)), key=lambda i: (-conduct_research_calls[i]["args"].get("priority", 0), i))
+    tasks = {i: asyncio.ensure_future(conduct_research(conduct_research_calls[i], run)) for i in launch_order}
+    return await asyncio.gather(*(tasks[i] for i in range(len(conduct_research_calls))))
+
+# %% [markdown]
+# With admission control in place, `supervisor_tools` simply hands its `ConductResearch` calls to `run_research_calls`. Excess calls wait their turn instead of being dropped, and the results still line up with the tool calls they answer.
+
 # %%
 async def supervisor_tools(state: SupervisorState) -> Command[Literal["red_team", "context_pruner", "__end__"]]:
     """
@@ -1683,7 +3306,8 @@ async def supervisor_tools(state: SupervisorState) -> Command[Literal["red_team"
 
         # If exiting, we prepare the final, curated notes for the report writer.
         # We prioritize the structured Knowledge Base, but fall back to raw notes if it's empty.
-        kb_notes = [f"{f.content} (Confidence: {f.confidence_score})" for f in state.get("knowledge_base", [])]
+        kb = state.get("knowledge_base") or FactStore()
+        kb_notes = [f"{f.content} (Confidence: {f.confidence_score}, Sources: {kb.corroboration(f)})" for f in kb]
         if not kb_notes: kb_notes = get_notes_from_tool_calls(state.get("supervisor_messages", []))
 
         # We return a Command to END this sub-graph and pass the final notes up to the main graph.
@@ -1707,11 +3331,8 @@ async def supervisor_tools(state: SupervisorState) -> Command[Literal["red_team"
     # 5. Handle 'ConductResearch' calls by fanning out to our research sub-graph in parallel.
     if conduct_research_calls:
 
-        # We create a list of coroutines, one for each research task.
-        coros = [researcher_agent.ainvoke({"researcher_messages": [HumanMessage(content=tc["args"]["research_topic"])], "research_topic": tc["args"]["research_topic"]}) for tc in conduct_research_calls]
-
-        # 'asyncio.gather' runs all the research sub-graphs concurrently.
-        results = await asyncio.gather(*coros)
+        # The governors run as many research sub-graphs concurrently as the run and the process allow, and queue the rest.
+        results = await run_research_calls(conduct_research_calls)
         for result, tool_call in zip(results, conduct_research_calls):
 
             # We append the clean, compressed research as a ToolMessage for the Supervisor's context.
@@ -1721,9 +3342,24 @@ async def supervisor_tools(state: SupervisorState) -> Command[Literal["red_team"
             all_raw_notes.extend(result.get("raw_notes", []))
 
     # 6. Handle 'refine_draft_report' calls. This is the core denoising and self-evaluation step.
+    refined_version = state.get("refined_kb_version", 0)
     for tool_call in refine_report_calls:
-        kb = state.get("knowledge_base", [])
-        kb_str = "CONFIRMED FACTS:\n" + "\n".join([f"- {f.content}" for f in kb]) if kb else "\n".join(get_notes_from_tool_calls(state.get("supervisor_messages", [])))
+        kb = state.get("knowledge_base") or FactStore()
+
+        # The draft already reflects the facts it was refined against, so we only pass what was added or changed since.
+        new_facts = kb.since(refined_version)
+        if new_facts:
+            kb_str = "NEW OR UPDATED FACTS SINCE THE LAST DRAFT:\n" + "\n".join(format_fact(f) for f in new_facts)
+        elif kb:
+            kb_str = "No new facts since the last draft; improve the existing draft."
+            # Disputed facts and low-confidence facts from a single source are the ones the draft most likely got wrong.
+            weak = [f for f in kb.with_confidence(0, LOW_CONFIDENCE_SCORE - 1) if not f.is_disputed and kb.corroboration(f) == 1]
+            if kb.disputed() or weak:
+                kb_str += "\nTreat these disputed or weakly supported facts with caution:\n" + "\n".join(format_fact(f) for f in kb.disputed() + weak)
+        else:
+            kb_str = "\n".join(get_notes_from_tool_calls(state.get("supervisor_messages", [])))
+        refined_version = kb.version
+        updates["refined_kb_version"] = refined_version
         new_draft = refine_draft_report.invoke({"research_brief": state.get("research_brief", ""), "findings": kb_str, "draft_report": state.get("draft_report", "")})
         
         # --- CRITICAL STEP: The Self-Evolution Evaluation ---
@@ -1747,7 +3383,7 @@ async def supervisor_tools(state: SupervisorState) -> Command[Literal["red_team"
     return Command(goto=["red_team", "context_pruner"], update=updates)
 
 # %% [markdown]
-# 1.  The `asyncio.gather(*coros)` call is the key to our parallel research, it invokes multiple instances of our `researcher_agent` sub-graph and waits for them all to complete.
+# 1.  The `run_research_calls` call is the key to our parallel research, it invokes multiple instances of our `researcher_agent` sub-graph under the governors and waits for them all to complete.
 # 2.  The most advanced part is the handling of the `refine_draft_report` call. Immediately after a new draft is generated, it is passed to our `evaluate_draft_quality` function.
 # 3.  This creates an incredibly tight feedback loop: the system refines, immediately self-evaluates, and then uses the `QualityMetric` to inform the very next reasoning step of the `supervisor` node.
 # 4.  The final `Command(goto=["red_team", "context_pruner"])` is another powerful parallel fan-out, sending the state to our self-correction agents simultaneously.
@@ -2093,8 +3729,10 @@ async def context_pruning_node(state: SupervisorState) -> dict:
         result = await structured_llm.ainvoke([HumanMessage(content=prompt)])
         new_facts = result.new_facts
         
-        # In a more advanced system, we would perform deduplication against the existing knowledge_base here.
-        message = f"[SYSTEM] Context Pruned. {len(new_facts)} new facts added to Knowledge Base. Raw notes buffer cleared."
+        # The FactStore reducer deduplicates against the existing knowledge_base, so we only report what is really new.
+        known = state.get("knowledge_base") or FactStore()
+        fresh = len({FactStore.key(f.content) for f in new_facts if f not in known})
+        message = f"[SYSTEM] Context Pruned. {fresh} new facts added to Knowledge Base ({len(new_facts) - fresh} already known). Raw notes buffer cleared."
     except Exception as e:
 
         # If the extraction fails, we create a system message to log the error.
@@ -2171,9 +3809,10 @@ scope_research = scope_builder.compile()
 # We initialize a new StateGraph for our researcher, specifying its unique input and output schemas.
 agent_builder = StateGraph(ResearcherState, output_schema=ResearcherOutputState)
 
-# We add the three nodes of the researcher's 'Think-Act-Compress' loop.
+# We add the four nodes of the researcher's 'Think-Act-Compress' loop, including the step-by-step compressor.
 agent_builder.add_node("llm_call", llm_call)
 agent_builder.add_node("tool_node", tool_node)
+agent_builder.add_node("compress_step", compress_step)
 agent_builder.add_node("compress_research", compress_research)
 
 # The entry point is the 'llm_call' node (the brain).
@@ -2186,8 +3825,10 @@ agent_builder.add_conditional_edges(
     {"tool_node": "tool_node", "compress_research": "compress_research"},
 )
 
-# After acting, the loop returns to the brain.
+# After acting, the loop returns to the brain, while the new results are compressed alongside it.
 agent_builder.add_edge("tool_node", "llm_call")
+agent_builder.add_edge("tool_node", "compress_step")
+agent_builder.add_edge("compress_step", END)
 
 # The compression step is the final output of this sub-graph.
 agent_builder.add_edge("compress_research", END)
@@ -2482,10 +4123,12 @@ and predict the resulting shift in insurance liability models for cross-border w
 config = {"configurable": {"thread_id": "demo_complex_1"}}
 # NOTE: The following execution assumes valid API keys are set and will take several minutes to run.
 # The output shown below is a formatted representation of a real execution trace.
-result = await agent.ainvoke(
-    {"messages": [HumanMessage(content=complex_query)]}, 
-    config=config
-)
+# 'research_run' gives every researcher in this run a shared view of the pages already found and summarized.
+with research_run(run_id=config["configurable"]["thread_id"]):
+    result = await agent.ainvoke(
+        {"messages": [HumanMessage(content=complex_query)]}, 
+        config=config
+    )
 
 # %% [markdown]
 # Let’s take at our query. I chose this specific pattern because it connects very different fields geopolitics, semiconductor strategy, and maritime insurance that are rarely discussed together.
@@ -3,56 +3,1387 @@ Crawl4AI HTTP Service
 Provides web scraping and content extraction as a REST API
 """
 
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, HttpUrl
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import urllib.error
+import urllib.request
+import zlib
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager, nullcontext
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import partial
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Literal, Optional
+from urllib.parse import parse_qsl, urldefrag, urlencode, urljoin, urlsplit, urlunsplit
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field, HttpUrl
 from crawl4ai import WebCrawler
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
 import uvicorn
 
-app = FastAPI(title="Crawl4AI Service", version="1.0.0")
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+# Configure logging
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Configuration
+CRAWL4AI_PORT = int(os.getenv("CRAWL4AI_PORT", "8000"))
+POOL_SIZE = int(os.getenv("CRAWLER_POOL_SIZE", "4"))
+POOL_MAX_QUEUE = int(os.getenv("CRAWLER_POOL_MAX_QUEUE", "32"))
+POOL_ACQUIRE_TIMEOUT = float(os.getenv("CRAWLER_POOL_ACQUIRE_TIMEOUT", "30"))
+POOL_MAX_PAGES_PER_CRAWLER = int(os.getenv("CRAWLER_MAX_PAGES", "200"))
+POOL_MAX_MEMORY_MB = int(os.getenv("CRAWLER_MAX_MEMORY_MB", "2048"))
+POOL_MEMORY_COOLDOWN = float(os.getenv("CRAWLER_MEMORY_COOLDOWN", "30"))
+POOL_MAX_CONSECUTIVE_FAILURES = int(os.getenv("CRAWLER_MAX_CONSECUTIVE_FAILURES", "3"))
+POOL_HEALTH_CHECK_INTERVAL = float(os.getenv("CRAWLER_HEALTH_CHECK_INTERVAL", "60"))
+CRAWL_TIMEOUT = float(os.getenv("CRAWL_TIMEOUT", "60"))
+CRAWL_MAX_TIMEOUT = float(os.getenv("CRAWL_MAX_TIMEOUT", "300"))
+DISCONNECT_POLL_INTERVAL = float(os.getenv("CRAWL_DISCONNECT_POLL_INTERVAL", "0.5"))
+PER_DOMAIN_CONCURRENCY = int(os.getenv("CRAWL_PER_DOMAIN_CONCURRENCY", "2"))
+BATCH_MAX_URLS = int(os.getenv("CRAWL_BATCH_MAX_URLS", "100"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("CRAWL_BATCH_MAX_CONCURRENCY", str(POOL_SIZE)))
+SITE_MAX_DEPTH = int(os.getenv("CRAWL_SITE_MAX_DEPTH", "5"))
+SITE_MAX_PAGES = int(os.getenv("CRAWL_SITE_MAX_PAGES", "500"))
+SITE_DEFAULT_PAGES = int(os.getenv("CRAWL_SITE_DEFAULT_PAGES", "50"))
+SITE_POLITENESS_DELAY = float(os.getenv("CRAWL_SITE_POLITENESS_DELAY", "1.0"))
+CACHE_ENABLED = os.getenv("CRAWL_CACHE_ENABLED", "true").lower() == "true"
+CACHE_DIR = os.getenv("CRAWL_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache"))
+CACHE_TTL = float(os.getenv("CRAWL_CACHE_TTL", "86400"))
+CACHE_MAX_MB = int(os.getenv("CRAWL_CACHE_MAX_MB", "512"))
+CACHE_REVALIDATE_TIMEOUT = float(os.getenv("CRAWL_CACHE_REVALIDATE_TIMEOUT", "5"))
+COMPRESSION_MIN_BYTES = int(os.getenv("CRAWL_COMPRESSION_MIN_BYTES", "1024"))
+COMPRESSION_OFFLOAD_BYTES = int(os.getenv("CRAWL_COMPRESSION_OFFLOAD_BYTES", "262144"))
+STREAM_CHUNK_CHARS = int(os.getenv("CRAWL_STREAM_CHUNK_CHARS", "65536"))
+CHARS_PER_TOKEN = 4  # Rough budget conversion; avoids shipping a tokenizer for one model family
+
+# ========== Metrics ==========
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+# queue: waiting for host/caller slots and a pooled crawler
+# render: WebCrawler.run, which covers the page fetch and browser rendering in one call
+# extract: building the response markdown from the crawl result
+# validate: the HEAD request that fetches cache validators
+STAGE_SECONDS = Histogram("crawl4ai_stage_seconds", "Time spent in each crawl stage", ["stage"], buckets=LATENCY_BUCKETS)
+CRAWL_SECONDS = Histogram(
+    "crawl4ai_crawl_seconds", "End-to-end time to serve one crawl, by where it came from", ["source"], buckets=LATENCY_BUCKETS
+)
+PAGE_BYTES = Counter("crawl4ai_page_bytes_total", "HTML bytes received from crawled pages")
+RESPONSE_BYTES = Counter("crawl4ai_response_bytes_total", "Response body bytes sent, after compression", ["encoding"])
+CACHE_LOOKUPS = Counter("crawl4ai_cache_lookups_total", "Crawl cache lookups by outcome", ["result"])
+# Crawl failures are counted once per shared crawl; callers that went away are counted as client_disconnect
+CRAWL_ERRORS = Counter("crawl4ai_errors_total", "Failed crawls by exception type", ["type"])
+COALESCED_REQUESTS = Counter(
+    "crawl4ai_coalesced_requests_total", "Crawl requests that started a shared crawl (leader) or joined one (follower)", ["role"]
+)
+
+# Sampled from the pool and cache on each scrape
+POOL_CRAWLERS = Gauge("crawl4ai_pool_crawlers", "Pooled crawlers by state", ["state"])
+POOL_QUEUE_DEPTH = Gauge("crawl4ai_pool_queue_depth", "Requests waiting for a pooled crawler")
+POOL_UTILIZATION = Gauge("crawl4ai_pool_utilization", "Fraction of the pool currently leased")
+POOL_MEMORY_MB = Gauge("crawl4ai_pool_memory_mb", "Resident memory of the service and its browsers")
+COALESCE_IN_FLIGHT = Gauge("crawl4ai_coalesce_in_flight", "Shared crawls currently running")
+CACHE_HIT_RATIO = Gauge("crawl4ai_cache_hit_ratio", "Share of cache lookups served without a crawl")
+CACHE_SIZE_MB = Gauge("crawl4ai_cache_size_mb", "Size of cached crawl payloads")
+
+# ========== Crawler Pool ==========
+class PoolSaturatedError(Exception):
+    """Raised when every crawler is busy and the wait queue is full"""
+
+
+@dataclass
+class PooledCrawler:
+    """A warm WebCrawler plus the bookkeeping used to decide when to recycle it"""
+    id: int
+    crawler: WebCrawler
+    pages_crawled: int = 0
+    consecutive_failures: int = 0
+    created_at: datetime = field(default_factory=datetime.utcnow)
+
+
+def _create_crawler() -> WebCrawler:
+    """Start a browser-backed crawler and warm it up (blocking)"""
+    crawler = WebCrawler()
+    crawler.warmup()
+    return crawler
+
+
+def _dispose_crawler(crawler: WebCrawler) -> None:
+    """Shut down the browser behind a crawler (blocking)"""
+    driver = getattr(getattr(crawler, "crawler_strategy", None), "driver", None)
+    if driver is None:
+        return
+    try:
+        driver.quit()
+    except Exception as e:
+        logger.warning(f"Failed to shut down crawler browser: {e}")
+
+
+def _process_memory_mb() -> float:
+    """Resident memory of this process and its browser children, in MB"""
+    if not PSUTIL_AVAILABLE:
+        return 0.0
+    process = psutil.Process()
+    rss = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            rss += child.memory_info().rss
+        except psutil.Error:
+            continue
+    return rss / (1024 * 1024)
+
+
+def _crawler_memory_mb(crawler: WebCrawler) -> float:
+    """Resident memory of the browser driving one crawler (chromedriver and its children), in MB"""
+    if not PSUTIL_AVAILABLE:
+        return 0.0
+    driver = getattr(getattr(crawler, "crawler_strategy", None), "driver", None)
+    service_process = getattr(getattr(driver, "service", None), "process", None)
+    pid = getattr(service_process, "pid", None)
+    if pid is None:
+        return 0.0
+    try:
+        root = psutil.Process(pid)
+        rss = root.memory_info().rss
+        children = root.children(recursive=True)
+    except psutil.Error:
+        return 0.0
+    for child in children:
+        try:
+            rss += child.memory_info().rss
+        except psutil.Error:
+            continue
+    return rss / (1024 * 1024)
+
+
+class CrawlerPool:
+    """
+    Fixed-size pool of warm WebCrawler instances.
+
+    Callers wait for an idle crawler in FIFO order. Once more than `max_queue`
+    callers are waiting, new requests are rejected instead of piling up.
+    Crawlers are recycled after `max_pages` pages or after repeated failures.
+    When the process tree exceeds `max_memory_mb`, the idle crawler whose own
+    browser is largest is recycled. Memory is checked at most once every
+    `memory_cooldown` seconds and each check recycles at most one crawler, so
+    a tree that stays over the ceiling (leased browsers, the service itself)
+    never turns into a restart loop.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        max_queue: int,
+        acquire_timeout: float,
+        max_pages: int,
+        max_memory_mb: int,
+        max_consecutive_failures: int,
+        memory_cooldown: float = 30.0,
+    ):
+        self.size = size
+        self.max_queue = max_queue
+        self.acquire_timeout = acquire_timeout
+        self.max_pages = max_pages
+        self.max_memory_mb = max_memory_mb
+        self.max_consecutive_failures = max_consecutive_failures
+        self.memory_cooldown = memory_cooldown
+
+        self._idle: asyncio.Queue[PooledCrawler] = asyncio.Queue()
+        self._next_id = 0
+        self._alive = 0
+        self._waiting = 0
+        self._in_use = 0
+        self._health_task: Optional[asyncio.Task] = None
+        self._releases: set[asyncio.Task] = set()  # asyncio only keeps weak references to running tasks
+        self._shedding = False
+        self._memory_checked_at = float("-inf")
+        self.memory_mb = 0.0  # Last sample of the process tree, taken off the event loop
+
+        self.total_acquired = 0
+        self.total_rejected = 0
+        self.total_recycled = 0
+
+    async def start(self, health_check_interval: float) -> None:
+        """Warm up every crawler and start the background health check"""
+        crawlers = await asyncio.gather(*(self._spawn() for _ in range(self.size)))
+        for pooled in crawlers:
+            self._idle.put_nowait(pooled)
+        self._health_task = asyncio.create_task(self._health_loop(health_check_interval))
+        await self.sample_memory()
+        logger.info(f"Crawler pool started with {self.size} warm instances")
+
+    async def close(self) -> None:
+        """Stop the health check and shut down all idle crawlers"""
+        if self._health_task:
+            self._health_task.cancel()
+        await asyncio.gather(*self._releases, return_exceptions=True)
+        while not self._idle.empty():
+            pooled = self._idle.get_nowait()
+            await asyncio.to_thread(_dispose_crawler, pooled.crawler)
+        logger.info("Crawler pool closed")
+
+    async def acquire(self) -> PooledCrawler:
+        """Wait for an idle crawler, applying backpressure when the queue is full"""
+        if self._idle.empty() and self._waiting >= self.max_queue:
+            self.total_rejected += 1
+            raise PoolSaturatedError(f"All {self.size} crawlers busy and {self._waiting} requests queued")
+
+        self._waiting += 1
+        try:
+            pooled = await asyncio.wait_for(self._idle.get(), timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.total_rejected += 1
+            raise PoolSaturatedError(f"No crawler became available within {self.acquire_timeout}s")
+        finally:
+            self._waiting -= 1
+
+        self._in_use += 1
+        self.total_acquired += 1
+        return pooled
+
+    async def release(self, pooled: PooledCrawler, failed: bool = False) -> None:
+        """Return a crawler to the pool, recycling it if it is worn out"""
+        self._in_use -= 1
+        pooled.pages_crawled += 1
+        pooled.consecutive_failures = pooled.consecutive_failures + 1 if failed else 0
+
+        reason = self._recycle_reason(pooled)
+        if reason:
+            pooled = await self._recycle(pooled, reason)
+        if pooled:
+            self._idle.put_nowait(pooled)
+        await self._shed_memory()
+
+    def release_soon(self, pooled: PooledCrawler, failed: bool = False) -> None:
+        """Schedule `release` from a loop callback, keeping the task alive until it finishes"""
+        task = asyncio.ensure_future(self.release(pooled, failed=failed))
+        self._releases.add(task)
+        task.add_done_callback(self._releases.discard)
+
+    def stats(self) -> dict:
+        """Snapshot of pool utilization"""
+        return {
+            "size": self.size,
+            "alive": self._alive,
+            "idle": self._idle.qsize(),
+            "inUse": self._in_use,
+            "queued": self._waiting,
+            "maxQueue": self.max_queue,
+            "totalAcquired": self.total_acquired,
+            "totalRejected": self.total_rejected,
+            "totalRecycled": self.total_recycled,
+            "memoryMb": round(self.memory_mb, 1),
+        }
+
+    def _recycle_reason(self, pooled: PooledCrawler) -> Optional[str]:
+        if pooled.pages_crawled >= self.max_pages:
+            return f"served {pooled.pages_crawled} pages"
+        if pooled.consecutive_failures >= self.max_consecutive_failures:
+            return f"{pooled.consecutive_failures} consecutive failures"
+        if not getattr(pooled.crawler, "ready", True):
+            return "crawler not ready"
+        return None
+
+    async def sample_memory(self) -> float:
+        """Measure the process tree on a worker thread; psutil walks every child process"""
+        self.memory_mb = await asyncio.to_thread(_process_memory_mb)
+        return self.memory_mb
+
+    async def _shed_memory(self) -> None:
+        """Recycle the largest idle crawler if the process tree is over the memory ceiling"""
+        if not self.max_memory_mb or self._shedding:
+            return
+        if time.monotonic() - self._memory_checked_at < self.memory_cooldown:
+            return
+        self._shedding = True
+        try:
+            self._memory_checked_at = time.monotonic()
+            memory_mb = await self.sample_memory()
+            if memory_mb <= self.max_memory_mb:
+                return
+
+            idle = self._idle_snapshot()
+            if not idle:
+                logger.warning(f"Memory at {memory_mb:.0f} MB exceeds {self.max_memory_mb} MB with no idle crawler to recycle")
+                return
+            sizes = await asyncio.to_thread(lambda: [_crawler_memory_mb(pooled.crawler) for pooled in idle])
+            largest = idle[sizes.index(max(sizes))]
+            # It may have been leased while we measured; the next check will pick another
+            if not self._take_idle(largest):
+                return
+            replacement = await self._recycle(largest, f"largest browser while memory at {memory_mb:.0f} MB > {self.max_memory_mb} MB")
+            if replacement:
+                self._idle.put_nowait(replacement)
+        finally:
+            self._shedding = False
+
+    def _idle_snapshot(self) -> list[PooledCrawler]:
+        idle = [self._idle.get_nowait() for _ in range(self._idle.qsize())]
+        for pooled in idle:
+            self._idle.put_nowait(pooled)
+        return idle
+
+    def _take_idle(self, target: PooledCrawler) -> bool:
+        """Remove one crawler from the idle queue, keeping the others in order"""
+        idle = [self._idle.get_nowait() for _ in range(self._idle.qsize())]
+        for pooled in idle:
+            if pooled is not target:
+                self._idle.put_nowait(pooled)
+        return target in idle
+
+    async def _spawn(self) -> PooledCrawler:
+        crawler = await asyncio.to_thread(_create_crawler)
+        self._next_id += 1
+        self._alive += 1
+        return PooledCrawler(id=self._next_id, crawler=crawler)
+
+    async def _recycle(self, pooled: PooledCrawler, reason: str) -> Optional[PooledCrawler]:
+        """Replace a crawler; returns None if the replacement failed to start"""
+        logger.info(f"Recycling crawler {pooled.id}: {reason}")
+        self.total_recycled += 1
+        self._alive -= 1
+        await asyncio.to_thread(_dispose_crawler, pooled.crawler)
+        try:
+            return await self._spawn()
+        except Exception as e:
+            logger.error(f"Failed to start replacement crawler: {e}")
+            return None
+
+    async def _health_loop(self, interval: float) -> None:
+        """Periodically inspect idle crawlers and replace unhealthy ones"""
+        while True:
+            await asyncio.sleep(interval)
+            for _ in range(self._idle.qsize()):
+                try:
+                    pooled = self._idle.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                reason = self._recycle_reason(pooled)
+                if reason:
+                    pooled = await self._recycle(pooled, reason)
+                if pooled:
+                    self._idle.put_nowait(pooled)
+            if self.max_memory_mb:
+                await self._shed_memory()
+            else:
+                await self.sample_memory()
+
+            # Top the pool back up if earlier replacements failed to start
+            while self._alive < self.size:
+                try:
+                    self._idle.put_nowait(await self._spawn())
+                except Exception as e:
+                    logger.error(f"Failed to restore crawler pool capacity: {e}")
+                    break
+
+
+crawler_pool = CrawlerPool(
+    size=POOL_SIZE,
+    max_queue=POOL_MAX_QUEUE,
+    acquire_timeout=POOL_ACQUIRE_TIMEOUT,
+    max_pages=POOL_MAX_PAGES_PER_CRAWLER,
+    max_memory_mb=POOL_MAX_MEMORY_MB,
+    max_consecutive_failures=POOL_MAX_CONSECUTIVE_FAILURES,
+    memory_cooldown=POOL_MEMORY_COOLDOWN,
+)
+
+
+# ========== Crawl Execution ==========
+# WebCrawler.run is blocking, so crawls run on a dedicated executor sized to
+# the pool. Each worker thread drives exactly one leased crawler at a time.
+crawl_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="crawl")
+
+
+class CrawlTimeoutError(Exception):
+    """Raised when a crawl does not finish within its timeout"""
+
+
+class CrawlFailedError(Exception):
+    """Raised when WebCrawler reports a failed crawl instead of raising"""
+
+
+def _render(crawler: WebCrawler, url: str):
+    """
+    Run a blocking crawl on a worker thread, recording browser time and page size.
+
+    WebCrawler.run reports most failures as `success=False` rather than
+    raising; those are raised here so the pool counts them against the
+    crawler and callers never receive an empty page as a result.
+    """
+    with STAGE_SECONDS.labels("render").time():
+        result = crawler.run(url=url, bypass_cache=True)
+    PAGE_BYTES.inc(len((getattr(result, "html", None) or "").encode("utf-8")))
+    if getattr(result, "success", True) is False:
+        raise CrawlFailedError(f"Crawl of {url} failed: {getattr(result, 'error_message', None) or 'unknown error'}")
+    return result
+
+
+class ClientDisconnectedError(Exception):
+    """Raised when the HTTP client goes away while its crawl is running"""
+
+
+class DomainLimiter:
+    """Caps concurrent crawls per host so one site is never hit by the whole pool"""
+
+    def __init__(self, per_domain: int):
+        self.per_domain = per_domain
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._users: dict[str, int] = defaultdict(int)
+
+    @asynccontextmanager
+    async def limit(self, host: str):
+        semaphore = self._semaphores.setdefault(host, asyncio.Semaphore(self.per_domain))
+        self._users[host] += 1
+        try:
+            async with semaphore:
+                yield
+        finally:
+            self._users[host] -= 1
+            if not self._users[host]:
+                del self._users[host]
+                del self._semaphores[host]
+
+
+domain_limiter = DomainLimiter(PER_DOMAIN_CONCURRENCY)
+
+
+def _host(url: str) -> str:
+    return (urlsplit(url).hostname or "").lower()
+
+
+async def _wait_for_disconnect(http_request: Request) -> None:
+    while not await http_request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+
+async def _wait_unless_disconnected(task: asyncio.Future, http_request: Optional[Request]):
+    """Wait for `task` without cancelling it, giving up if the client disconnects first"""
+    if http_request is None:
+        return await asyncio.shield(task)
+    disconnect = asyncio.create_task(_wait_for_disconnect(http_request))
+    try:
+        done, _ = await asyncio.wait({task, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnect.cancel()
+    if task in done:
+        return task.result()
+    raise ClientDisconnectedError("Client disconnected while waiting for a shared crawl")
+
+
+@dataclass
+class _Flight:
+    task: asyncio.Task
+    waiters: int = 0
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key onto one shared task.
+
+    The first caller starts the work; later callers with the same key attach
+    to it and receive the same result or exception. The shared task is only
+    cancelled once every attached caller has gone away.
+    """
+
+    def __init__(self):
+        self._flights: dict[str, _Flight] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[Any]], http_request: Optional[Request] = None):
+        flight = self._flights.get(key)
+        if flight is None or flight.task.done():
+            self.leaders += 1
+            COALESCED_REQUESTS.labels("leader").inc()
+            flight = _Flight(task=asyncio.ensure_future(fn()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        else:
+            self.followers += 1
+            COALESCED_REQUESTS.labels("follower").inc()
+
+        flight.waiters += 1
+        try:
+            return await _wait_unless_disconnected(flight.task, http_request)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    def stats(self) -> dict:
+        calls = self.leaders + self.followers
+        return {
+            "inFlight": len(self._flights),
+            "leaders": self.leaders,
+            "coalesced": self.followers,
+            "coalescedRatio": round(self.followers / calls, 3) if calls else 0.0,
+        }
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+
+crawl_flights = SingleFlight()
+
+
+def _release_when_done(pooled: PooledCrawler, crawl: Future, loop: asyncio.AbstractEventLoop) -> None:
+    """Return the crawler to the pool only once its worker thread has finished with it"""
+    def _on_done(future: Future) -> None:
+        failed = future.cancelled() or future.exception() is not None
+        try:
+            loop.call_soon_threadsafe(crawler_pool.release_soon, pooled, failed)
+        except RuntimeError:
+            # The lifespan has already closed the loop, so nobody will take this crawler back
+            _dispose_crawler(pooled.crawler)
+    crawl.add_done_callback(_on_done)
+
+
+async def run_crawl(url: str, timeout: float, slot: Optional[asyncio.Semaphore] = None):
+    """
+    Crawl a single URL on a pooled crawler without blocking the event loop.
+
+    Waits for a per-host slot first, then for the optional caller-wide `slot`,
+    so a caller's slots are never held by requests stuck behind a busy host.
+    The `timeout` covers the whole request, including the waits for those
+    slots and for a pooled crawler, not only the crawl itself.
+    """
+    queued_at = time.perf_counter()
+    try:
+        async with asyncio.timeout(timeout):
+            async with domain_limiter.limit(_host(url)):
+                async with slot or nullcontext():
+                    return await _run_pooled_crawl(url, queued_at)
+    except TimeoutError:
+        raise CrawlTimeoutError(f"Crawl of {url} exceeded {timeout}s") from None
+
+
+async def _run_pooled_crawl(url: str, queued_at: float):
+    """
+    Run one crawl on a leased crawler and wait for it.
+
+    A thread that is already running cannot be interrupted, so an abandoned
+    crawler is returned to the pool when its thread finishes rather than
+    immediately.
+    """
+    pooled = await crawler_pool.acquire()
+    STAGE_SECONDS.labels("queue").observe(time.perf_counter() - queued_at)
+    loop = asyncio.get_running_loop()
+    crawl = crawl_executor.submit(_render, pooled.crawler, url)
+    _release_when_done(pooled, crawl, loop)
+
+    try:
+        return await asyncio.wrap_future(crawl)
+    except asyncio.CancelledError:
+        # Abandoning the crawl: cancelling only succeeds while it is still
+        # queued on the executor, and a late failure is deliberately ignored.
+        crawl.cancel()
+        raise
+
+
+# ========== Crawl Cache ==========
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a URL for cache keys: case-folded host, no default port, sorted query, no fragment"""
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    netloc = host if parts.port in (None, DEFAULT_PORTS.get(scheme)) else f"{host}:{parts.port}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or "/", query, ""))
+
+
+@STAGE_SECONDS.labels("validate").time()
+def fetch_validators(url: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> tuple[int, Optional[str], Optional[str]]:
+    """
+    Issue a (conditional) HEAD request and return (status, ETag, Last-Modified).
+
+    A 304 means the cached copy is still current. Network failures return
+    status 0 so callers fall back to a full crawl.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    head = urllib.request.Request(url, method="HEAD", headers=headers)
+    try:
+        with urllib.request.urlopen(head, timeout=CACHE_REVALIDATE_TIMEOUT) as response:
+            return response.status, response.headers.get("ETag"), response.headers.get("Last-Modified")
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers.get("ETag"), e.headers.get("Last-Modified")
+    except Exception as e:
+        logger.debug(f"Validator request for {url} failed: {e}")
+        return 0, None, None
+
+
+@dataclass
+class CacheEntry:
+    payload: dict
+    etag: Optional[str]
+    last_modified: Optional[str]
+    stored_at: float
+
+
+class CrawlCache:
+    """
+    On-disk crawl cache backed by SQLite.
+
+    Entries are keyed by a hash of the normalized URL plus the extraction
+    options, expire after `ttl` seconds, and are evicted least-recently-used
+    first once the stored payloads exceed `max_bytes`. Expired entries that
+    carry an ETag or Last-Modified can be revalidated instead of re-crawled.
+    """
+
+    def __init__(self, directory: str, ttl: float, max_bytes: int):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, "crawl_cache.db"), check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                stored_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                size INTEGER NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
 
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(url: str, options: dict) -> str:
+        material = json.dumps({"url": normalize_url(url), "options": options}, sort_keys=True)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        return time.time() - entry.stored_at < self.ttl
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, etag, last_modified, stored_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return CacheEntry(payload=json.loads(row[0]), etag=row[1], last_modified=row[2], stored_at=row[3])
+
+    def put(self, key: str, url: str, payload: dict, etag: Optional[str], last_modified: Optional[str]) -> None:
+        data = json.dumps(payload)
+        size = len(data.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, url, data, etag, last_modified, now, now, size),
+            )
+            self._total_bytes += size - (previous[0] if previous else 0)
+            self._evict_locked()
+            self._conn.commit()
+
+    def touch(self, key: str) -> None:
+        """Mark an entry as freshly validated"""
+        with self._lock:
+            self._conn.execute("UPDATE entries SET stored_at = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.revalidated + self.misses
+        return {
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "hitRatio": round((self.hits + self.revalidated) / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "sizeMb": round(self._total_bytes / (1024 * 1024), 1),
+            "maxMb": round(self.max_bytes / (1024 * 1024), 1),
+        }
+
+    def _evict_locked(self) -> None:
+        while self._total_bytes > self.max_bytes:
+            row = self._conn.execute("SELECT key, size FROM entries ORDER BY last_access LIMIT 1").fetchone()
+            if row is None:
+                break
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (row[0],))
+            self._total_bytes -= row[1]
+            self.evictions += 1
+
+
+# Opened in the lifespan so importing the module never touches the filesystem
+crawl_cache: Optional[CrawlCache] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global crawl_cache
+    if CACHE_ENABLED:
+        crawl_cache = await asyncio.to_thread(CrawlCache, CACHE_DIR, CACHE_TTL, CACHE_MAX_MB * 1024 * 1024)
+    await crawler_pool.start(POOL_HEALTH_CHECK_INTERVAL)
+    yield
+    crawl_executor.shutdown(wait=False, cancel_futures=True)
+    await crawler_pool.close()
+    if crawl_cache:
+        crawl_cache.close()
+        crawl_cache = None
+
+
+app = FastAPI(title="Crawl4AI Service", version="1.0.0", lifespan=lifespan)
+
+# ========== Content Extraction ==========
+MARKDOWN_LINK = re.compile(r"!?\[([^\]]*)\]\([^)]*\)")
+# An unclosed fence runs to the end of the document, as in CommonMark
+FENCED_CODE = re.compile(r"^ {0,3}(`{3,}|~{3,})[^\n]*\n.*?(?:^ {0,3}\1[ \t]*$|\Z)", re.MULTILINE | re.DOTALL)
+INLINE_CODE = re.compile(r"(`+).+?(?<!`)\1(?!`)", re.DOTALL)
+BOILERPLATE = re.compile(
+    r"cookie|privacy policy|terms of (use|service)|all rights reserved|©|subscribe|newsletter|"
+    r"sign in|sign up|log in|skip to (main )?content|share (on|this)|follow us|advertisement",
+    re.IGNORECASE,
+)
+BOILERPLATE_MAX_CHARS = 200
+LINK_DENSITY_THRESHOLD = 0.5
+
+
+def _strip_links(text: str) -> str:
+    """Replace markdown links and images with their text, leaving inline code spans as written"""
+    pieces = []
+    last = 0
+    for code in INLINE_CODE.finditer(text):
+        pieces.append(MARKDOWN_LINK.sub(r"\1", text[last:code.start()]))
+        pieces.append(code.group())
+        last = code.end()
+    pieces.append(MARKDOWN_LINK.sub(r"\1", text[last:]))
+    return "".join(pieces)
+
+
+def _is_boilerplate(block: str) -> bool:
+    """Heuristic for navigation menus, link farms, cookie banners and footers"""
+    text = _strip_links(block)
+    visible = len(text.strip())
+    if visible == 0:
+        # Image-only or link-only block with no readable text
+        return True
+
+    # Bracket-paren sequences inside code spans are code, not links
+    prose = INLINE_CODE.sub("", block)
+    link_chars = sum(len(m.group(1)) for m in MARKDOWN_LINK.finditer(prose))
+    if link_chars / visible > LINK_DENSITY_THRESHOLD:
+        return True
+
+    lines = [line.strip() for line in block.splitlines() if line.strip()]
+    if len(lines) > 2 and all(line.startswith(("-", "*", "+")) and len(line) < 60 for line in lines):
+        # Bulleted lists of short entries are almost always menus
+        link_lines = sum(1 for line in lines if MARKDOWN_LINK.search(INLINE_CODE.sub("", line)))
+        if link_lines >= len(lines) / 2:
+            return True
+
+    return visible < BOILERPLATE_MAX_CHARS and bool(BOILERPLATE.search(text))
+
+
+def clean_markdown(markdown: str) -> str:
+    """
+    Strip navigation, boilerplate and repeated blocks from crawled markdown.
+
+    Link targets are dropped as well: downstream consumers summarize the
+    text, and URLs are often the bulk of a menu-heavy page. Fenced code
+    blocks are kept verbatim and inline code spans are never rewritten.
+    """
+    seen = set()
+    kept = []
+
+    def clean_prose(text: str) -> None:
+        for block in re.split(r"\n\s*\n", text):
+            block = block.strip()
+            if not block or _is_boilerplate(block):
+                continue
+            fingerprint = " ".join(block.lower().split())
+            if fingerprint in seen:
+                continue
+            seen.add(fingerprint)
+            kept.append(_strip_links(block))
+
+    last = 0
+    for fence in FENCED_CODE.finditer(markdown):
+        clean_prose(markdown[last:fence.start()])
+        kept.append(fence.group().strip("\n"))
+        last = fence.end()
+    clean_prose(markdown[last:])
+    return "\n\n".join(kept)
+
+
+def cap_text(text: str, max_chars: Optional[int]) -> tuple[str, bool]:
+    """Truncate to `max_chars`, preferring a paragraph or sentence boundary"""
+    if max_chars is None or len(text) <= max_chars:
+        return text, False
+    cut = text[:max_chars]
+    boundary = max(cut.rfind("\n\n"), cut.rfind(". "))
+    if boundary > max_chars // 2:
+        cut = cut[:boundary + 1]
+    return cut.rstrip(), True
+
+
+# ========== Models ==========
 class CrawlRequest(BaseModel):
     url: HttpUrl
     extract_text: bool = True
     extract_links: bool = False
-    max_depth: int = 1
+    include_html: bool = False
+    mode: Literal["full", "clean"] = "full"
+    max_chars: int | None = Field(default=None, gt=0)
+    max_tokens: int | None = Field(default=None, gt=0)
+    max_depth: int = Field(default=1, ge=1)  # Only /crawl/site follows links; /crawl and /crawl/batch reject depths above 1
+    timeout: float = Field(default=CRAWL_TIMEOUT, gt=0, le=CRAWL_MAX_TIMEOUT)
+    bypass_cache: bool = False
+
+    def char_budget(self) -> Optional[int]:
+        """Effective markdown cap: the tighter of max_chars and max_tokens"""
+        budgets = [b for b in (self.max_chars, self.max_tokens and self.max_tokens * CHARS_PER_TOKEN) if b]
+        return min(budgets) if budgets else None
 
 class CrawlResponse(BaseModel):
     url: str
     markdown: str
     html: str | None = None
     links: list[str] | None = None
+    truncated: bool = False
+    original_chars: int | None = None
+
+class CrawlBatchRequest(BaseModel):
+    items: list[CrawlRequest] = Field(min_length=1, max_length=BATCH_MAX_URLS)
+    max_concurrency: int = Field(default=BATCH_MAX_CONCURRENCY, ge=1, le=max(BATCH_MAX_CONCURRENCY, POOL_SIZE))
+
+class CrawlBatchItem(BaseModel):
+    """One NDJSON line of a batch crawl; exactly one of result/error is set"""
+    index: int
+    url: str
+    status_code: int
+    result: CrawlResponse | None = None
+    error: str | None = None
+
+class SiteCrawlRequest(CrawlRequest):
+    """A seed URL plus the budgets that bound how far its links are followed"""
+    max_depth: int = Field(default=2, ge=1, le=SITE_MAX_DEPTH)
+    max_pages: int = Field(default=SITE_DEFAULT_PAGES, ge=1, le=SITE_MAX_PAGES)
+    max_concurrency: int = Field(default=min(2, POOL_SIZE), ge=1, le=POOL_SIZE)
+    same_host: bool = True
+    path_prefix: str | None = None
+    politeness_delay: float = Field(default=SITE_POLITENESS_DELAY, ge=0, le=60)
+
+class SiteCrawlItem(BaseModel):
+    """One NDJSON line of a site crawl; exactly one of result/error is set"""
+    url: str
+    depth: int
+    status_code: int
+    result: CrawlResponse | None = None
+    error: str | None = None
+
+def _flatten_links(links) -> list[str]:
+    """crawl4ai groups links as {"internal": [...], "external": [...]} of href dicts; return plain URLs"""
+    if isinstance(links, dict):
+        links = [link for group in links.values() for link in group]
+    hrefs = [link.get("href") if isinstance(link, dict) else link for link in links or []]
+    return list(dict.fromkeys(href for href in hrefs if href))
+
+@STAGE_SECONDS.labels("extract").time()
+def _build_response(request: CrawlRequest, result) -> CrawlResponse:
+    markdown = (result.markdown or "") if request.extract_text else ""
+    original_chars = len(markdown)
+    if request.mode == "clean":
+        markdown = clean_markdown(markdown)
+    markdown, truncated = cap_text(markdown, request.char_budget())
+
+    return CrawlResponse(
+        url=str(request.url),
+        markdown=markdown,
+        html=result.html if request.include_html else None,
+        links=_flatten_links(result.links) if request.extract_links else None,
+        truncated=truncated,
+        original_chars=original_chars if request.mode == "clean" or truncated else None,
+    )
+
+def _single_page_only(request: CrawlRequest) -> None:
+    """Reject link-following depths on endpoints that fetch single pages"""
+    if request.max_depth > 1:
+        raise HTTPException(
+            status_code=422,
+            detail=f"max_depth={request.max_depth} is only supported by /crawl/site; /crawl and /crawl/batch fetch single pages",
+        )
+
+def _crawl_error(e: Exception) -> HTTPException:
+    """Map a crawl failure onto the HTTP error reported to the client"""
+    if isinstance(e, ClientDisconnectedError):
+        CRAWL_ERRORS.labels("client_disconnect").inc()
+    if isinstance(e, PoolSaturatedError):
+        return HTTPException(status_code=503, detail=f"Crawler pool saturated: {str(e)}", headers={"Retry-After": "5"})
+    if isinstance(e, CrawlTimeoutError):
+        return HTTPException(status_code=504, detail=str(e))
+    if isinstance(e, CrawlFailedError):
+        return HTTPException(status_code=502, detail=str(e))
+    if isinstance(e, ClientDisconnectedError):
+        return HTTPException(status_code=499, detail=str(e))
+    return HTTPException(status_code=500, detail=f"Crawl failed: {str(e)}")
+
+def _cache_options(request: CrawlRequest) -> dict:
+    """Request options that change the cached response"""
+    return {
+        "extract_text": request.extract_text,
+        "extract_links": request.extract_links,
+        "include_html": request.include_html,
+        "mode": request.mode,
+        "max_chars": request.char_budget(),
+    }
+
+async def crawl_with_cache(
+    request: CrawlRequest,
+    http_request: Optional[Request] = None,
+    slot: Optional[asyncio.Semaphore] = None,
+) -> CrawlResponse:
+    """
+    Serve a crawl from the cache when possible, otherwise crawl and store it.
+
+    Identical requests already in flight are coalesced onto a single crawl,
+    which runs under the first caller's timeout and slot. Each caller still
+    gives up on its own if its client disconnects.
+    """
+    key = CrawlCache.key(str(request.url), _cache_options(request))
+    if request.bypass_cache:
+        key += ":fresh"
+    return await crawl_flights.run(key, partial(_count_crawl_errors, request, slot), http_request)
+
+async def _count_crawl_errors(request: CrawlRequest, slot: Optional[asyncio.Semaphore]) -> CrawlResponse:
+    """Run the shared crawl, counting its failure once rather than once per coalesced caller"""
+    try:
+        return await _load_or_crawl(request, slot)
+    except Exception as e:
+        CRAWL_ERRORS.labels(type(e).__name__).inc()
+        raise
+
+async def _load_or_crawl(request: CrawlRequest, slot: Optional[asyncio.Semaphore]) -> CrawlResponse:
+    """
+    Load a crawl from the cache, revalidating or re-crawling as needed.
+
+    Expired entries with validators are revalidated with a conditional HEAD;
+    a 304 refreshes the entry without launching a browser. A URL seen for the
+    first time is crawled without any HEAD request.
+    """
+    url = str(request.url)
+    started = time.perf_counter()
+    if crawl_cache is None or request.bypass_cache:
+        response = _build_response(request, await run_crawl(url, request.timeout, slot=slot))
+        CRAWL_SECONDS.labels("uncached").observe(time.perf_counter() - started)
+        return response
+
+    key = crawl_cache.key(url, _cache_options(request))
+    entry = await asyncio.to_thread(crawl_cache.get, key)
+    if entry and crawl_cache.is_fresh(entry):
+        crawl_cache.hits += 1
+        CACHE_LOOKUPS.labels("hit").inc()
+        CRAWL_SECONDS.labels("hit").observe(time.perf_counter() - started)
+        return CrawlResponse(**entry.payload)
+
+    if entry and (entry.etag or entry.last_modified):
+        status, _, _ = await asyncio.to_thread(fetch_validators, url, entry.etag, entry.last_modified)
+        if status == 304:
+            await asyncio.to_thread(crawl_cache.touch, key)
+            crawl_cache.revalidated += 1
+            CACHE_LOOKUPS.labels("revalidated").inc()
+            CRAWL_SECONDS.labels("revalidated").observe(time.perf_counter() - started)
+            return CrawlResponse(**entry.payload)
+
+    crawl_cache.misses += 1
+    CACHE_LOOKUPS.labels("miss").inc()
+    if entry is None:
+        result = await run_crawl(url, request.timeout, slot=slot)
+        etag = last_modified = None
+    else:
+        # The browser does not expose response headers, so validators for the next
+        # expiry come from a HEAD issued alongside the re-crawl of a stale entry
+        result, (_, etag, last_modified) = await asyncio.gather(
+            run_crawl(url, request.timeout, slot=slot),
+            asyncio.to_thread(fetch_validators, url),
+        )
+    response = _build_response(request, result)
+    # Failed crawls raise CrawlFailedError before reaching here, so only real pages are cached
+    await asyncio.to_thread(crawl_cache.put, key, url, response.model_dump(), etag, last_modified)
+    CRAWL_SECONDS.labels("miss").observe(time.perf_counter() - started)
+    return response
 
+# ========== Response Encoding ==========
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick zstd or gzip from an Accept-Encoding header, honoring q=0 exclusions"""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.lower()] = quality
+    for encoding in ("zstd", "gzip"):
+        if encoding == "zstd" and not ZSTD_AVAILABLE:
+            continue
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+class _Compressor:
+    """Incremental compressor that can flush after every chunk for streaming"""
+
+    def __init__(self, encoding: str):
+        if encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor().compressobj()
+            self._flush_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            self._obj = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+            self._flush_mode = zlib.Z_SYNC_FLUSH
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        out = self._obj.compress(data)
+        return out + self._obj.flush(self._flush_mode) if flush else out
+
+    def finish(self) -> bytes:
+        return self._obj.flush()
+
+    async def compress_async(self, data: bytes, flush: bool) -> bytes:
+        """Compress on a worker thread once the input is big enough to stall the event loop"""
+        if len(data) >= COMPRESSION_OFFLOAD_BYTES:
+            return await asyncio.to_thread(self.compress, data, flush)
+        return self.compress(data, flush)
+
+
+async def _encode_chunks(chunks: AsyncIterable[str], encoding: Optional[str], flush: bool) -> AsyncIterator[bytes]:
+    compressor = _Compressor(encoding) if encoding else None
+    sent = RESPONSE_BYTES.labels(encoding or "identity")
+    async for chunk in chunks:
+        data = chunk.encode("utf-8")
+        if compressor:
+            data = await compressor.compress_async(data, flush)
+        if data:
+            sent.inc(len(data))
+            yield data
+    if compressor:
+        data = compressor.finish()
+        sent.inc(len(data))
+        yield data
+
+
+def encoded_stream(chunks: AsyncIterable[str], media_type: str, http_request: Request, flush: bool = True) -> StreamingResponse:
+    """Stream text chunks, compressed with whatever the client negotiated"""
+    encoding = negotiate_encoding(http_request.headers.get("accept-encoding", ""))
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return StreamingResponse(_encode_chunks(chunks, encoding, flush), media_type=media_type, headers=headers)
+
+
+async def encoded_json(body: str, http_request: Request) -> Response:
+    """Return a JSON body, compressed when it is large enough to be worth it"""
+    encoding = negotiate_encoding(http_request.headers.get("accept-encoding", ""))
+    data = body.encode("utf-8")
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding and len(data) >= COMPRESSION_MIN_BYTES:
+        compressor = _Compressor(encoding)
+        data = await compressor.compress_async(data, flush=False) + compressor.finish()
+        headers["Content-Encoding"] = encoding
+    RESPONSE_BYTES.labels(headers.get("Content-Encoding", "identity")).inc(len(data))
+    return Response(content=data, media_type="application/json", headers=headers)
+
+
+async def iter_json_chunks(response: BaseModel, chunk_chars: int) -> AsyncIterator[str]:
+    """
+    Serialize a model as JSON in pieces, slicing large string fields.
+
+    Yields the same document `model_dump_json` would produce, but never holds
+    a second full copy of the markdown/html in serialized form.
+    """
+    # Compact separators and raw non-ASCII, matching pydantic's serializer
+    dumps = partial(json.dumps, ensure_ascii=False, separators=(",", ":"))
+    fields = response.model_dump(mode="json")
+    yield "{"
+    for i, (name, value) in enumerate(fields.items()):
+        yield ("," if i else "") + dumps(name) + ":"
+        if isinstance(value, str) and len(value) > chunk_chars:
+            yield '"'
+            for start in range(0, len(value), chunk_chars):
+                yield dumps(value[start:start + chunk_chars])[1:-1]
+                await asyncio.sleep(0)
+            yield '"'
+        else:
+            yield dumps(value)
+    yield "}"
+
+
+# ========== Crawl Endpoints ==========
 @app.post("/crawl", response_model=CrawlResponse)
-async def crawl_webpage(request: CrawlRequest):
+async def crawl_webpage(request: CrawlRequest, http_request: Request, stream: bool = False):
     """
     Crawl a webpage and extract content.
-    
+
+    The body is gzip/zstd compressed when the client's Accept-Encoding allows it.
+
     Args:
         request: CrawlRequest with URL and crawling parameters
-        
+        http_request: Incoming HTTP request, watched for client disconnects
+        stream: Send the JSON body in chunks instead of one serialized document
+
     Returns:
         CrawlResponse with extracted content
     """
+    _single_page_only(request)
     try:
-        crawler = WebCrawler()
-        result = crawler.run(
-            url=str(request.url),
-            bypass_cache=True
-        )
-        
-        return CrawlResponse(
-            url=str(request.url),
-            markdown=result.markdown or "",
-            html=result.html if request.extract_text else None,
-            links=result.links if request.extract_links else None
-        )
+        response = await crawl_with_cache(request, http_request)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Crawl failed: {str(e)}")
+        raise _crawl_error(e)
+
+    if stream:
+        return encoded_stream(iter_json_chunks(response, STREAM_CHUNK_CHARS), "application/json", http_request, flush=False)
+    return await encoded_json(response.model_dump_json(), http_request)
+
+@app.post("/crawl/batch")
+async def crawl_batch(batch: CrawlBatchRequest, http_request: Request):
+    """
+    Crawl many webpages concurrently, streaming results as NDJSON.
+
+    Each line is a CrawlBatchItem, emitted as soon as its crawl finishes, so
+    lines arrive in completion order; use `index` to match them to the input.
+
+    Args:
+        batch: CrawlBatchRequest with per-URL crawl options
+        http_request: Incoming HTTP request, used to negotiate compression
+
+    Returns:
+        StreamingResponse of newline-delimited CrawlBatchItem objects
+    """
+    for item in batch.items:
+        _single_page_only(item)
+    return encoded_stream(_stream_batch(batch), "application/x-ndjson", http_request)
+
+async def _stream_batch(batch: CrawlBatchRequest) -> AsyncIterator[str]:
+    slot = asyncio.Semaphore(batch.max_concurrency)
+
+    async def crawl_one(index: int, request: CrawlRequest) -> CrawlBatchItem:
+        url = str(request.url)
+        try:
+            result = await crawl_with_cache(request, slot=slot)
+            return CrawlBatchItem(index=index, url=url, status_code=200, result=result)
+        except Exception as e:
+            error = _crawl_error(e)
+            return CrawlBatchItem(index=index, url=url, status_code=error.status_code, error=error.detail)
+
+    tasks = [asyncio.create_task(crawl_one(i, item)) for i, item in enumerate(batch.items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            item = await next_done
+            yield item.model_dump_json(exclude_none=True) + "\n"
+    finally:
+        # The client went away mid-stream; stop the crawls that have not finished
+        for task in tasks:
+            task.cancel()
+
+# ========== Site Crawl ==========
+class HostPoliteness:
+    """Spaces out request starts to each host by a fixed delay"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._next_start: dict[str, float] = {}
+
+    async def wait(self, host: str):
+        now = asyncio.get_running_loop().time()
+        start = max(now, self._next_start.get(host, now))
+        self._next_start[host] = start + self.delay
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+SKIPPED_EXTENSIONS = (".pdf", ".zip", ".gz", ".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".mp4", ".mp3", ".css", ".js")
+
+def _follow(site: SiteCrawlRequest, seed_host: str, url: str) -> bool:
+    """Whether a discovered link is in scope for this site crawl"""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+        return False
+    if site.same_host and (parts.hostname or "").lower() != seed_host:
+        return False
+    if site.path_prefix and not parts.path.startswith(site.path_prefix):
+        return False
+    return not parts.path.lower().endswith(SKIPPED_EXTENSIONS)
+
+
+@app.post("/crawl/site")
+async def crawl_site(site: SiteCrawlRequest, http_request: Request):
+    """
+    Crawl a site breadth-first from a seed URL, streaming pages as NDJSON.
+
+    Links are followed up to `max_depth` (the seed is depth 1) and until
+    `max_pages` pages have been scheduled. Each URL is crawled once, and
+    requests to the same host start at least `politeness_delay` seconds apart.
 
+    Args:
+        site: SiteCrawlRequest with the seed URL, budgets and per-page options
+        http_request: Incoming HTTP request, used to negotiate compression
+
+    Returns:
+        StreamingResponse of newline-delimited SiteCrawlItem objects
+    """
+    return encoded_stream(_stream_site(site), "application/x-ndjson", http_request)
+
+async def _stream_site(site: SiteCrawlRequest) -> AsyncIterator[str]:
+    seed = str(site.url)
+    seed_host = _host(seed)
+    page_options = site.model_dump(include=set(CrawlRequest.model_fields))
+    # Links are always extracted so the frontier can grow; they are dropped from output unless requested
+    page_options.update(extract_links=True, max_depth=1)
+
+    frontier: asyncio.PriorityQueue = asyncio.PriorityQueue()
+    results: asyncio.Queue = asyncio.Queue()
+    seen = {normalize_url(seed)}
+    scheduled = 1
+    frontier.put_nowait((1, 0, seed))
+    slot = asyncio.Semaphore(site.max_concurrency)
+    politeness = HostPoliteness(site.politeness_delay)
+
+    def schedule(page_url: str, links: list[str], depth: int):
+        nonlocal scheduled
+        for href in links:
+            if scheduled >= site.max_pages:
+                return
+            try:
+                link = urldefrag(urljoin(page_url, href))[0]
+                if not _follow(site, seed_host, link):
+                    continue
+                key = normalize_url(link)
+            except ValueError as e:
+                # Malformed hrefs (bad IPv6 hosts, non-numeric ports) are skipped, not fatal
+                logger.debug(f"Skipping malformed link {href!r} on {page_url}: {e}")
+                continue
+            if key in seen:
+                continue
+            seen.add(key)
+            frontier.put_nowait((depth + 1, scheduled, link))
+            scheduled += 1
+
+    async def crawl_page(url: str, depth: int) -> SiteCrawlItem:
+        try:
+            await politeness.wait(_host(url))
+            result = await crawl_with_cache(CrawlRequest(**{**page_options, "url": url}), slot=slot)
+        except Exception as e:
+            error = _crawl_error(e)
+            return SiteCrawlItem(url=url, depth=depth, status_code=error.status_code, error=error.detail)
+        if depth < site.max_depth:
+            schedule(url, result.links or [], depth)
+        if not site.extract_links:
+            result = result.model_copy(update={"links": None})
+        return SiteCrawlItem(url=url, depth=depth, status_code=200, result=result)
+
+    async def worker():
+        while True:
+            depth, _, url = await frontier.get()
+            try:
+                try:
+                    item = await crawl_page(url, depth)
+                except Exception as e:
+                    # A dead worker would leave frontier.join() waiting forever, so report the page and carry on
+                    logger.exception(f"Site crawl of {url} failed")
+                    item = SiteCrawlItem(url=url, depth=depth, status_code=500, error=f"Crawl failed: {str(e)}")
+                await results.put(item)
+            finally:
+                frontier.task_done()
+
+    async def drained():
+        await frontier.join()
+        await results.put(None)
+
+    tasks = [asyncio.create_task(worker()) for _ in range(site.max_concurrency)]
+    tasks.append(asyncio.create_task(drained()))
+    try:
+        while (item := await results.get()) is not None:
+            yield item.model_dump_json(exclude_none=True) + "\n"
+    finally:
+        for task in tasks:
+            task.cancel()
+
+# ========== Health & Stats Endpoints ==========
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "crawl4ai"}
+    return {"status": "healthy", "service": "crawl4ai", "pool": crawler_pool.stats()}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: stage latencies, bytes, cache, pool, coalescing and error counts"""
+    pool = crawler_pool.stats()
+    POOL_CRAWLERS.labels("alive").set(pool["alive"])
+    POOL_CRAWLERS.labels("idle").set(pool["idle"])
+    POOL_CRAWLERS.labels("in_use").set(pool["inUse"])
+    POOL_QUEUE_DEPTH.set(pool["queued"])
+    POOL_UTILIZATION.set(pool["inUse"] / pool["size"] if pool["size"] else 0.0)
+    POOL_MEMORY_MB.set(pool["memoryMb"])
+    if crawl_cache:
+        cache = crawl_cache.stats()
+        CACHE_HIT_RATIO.set(cache["hitRatio"])
+        CACHE_SIZE_MB.set(cache["sizeMb"])
+    COALESCE_IN_FLIGHT.set(crawl_flights.stats()["inFlight"])
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/stats")
+async def get_stats():
+    """Crawler pool utilization, cache effectiveness and request coalescing"""
+    return {
+        "pool": crawler_pool.stats(),
+        "cache": crawl_cache.stats() if crawl_cache else None,
+        "coalescing": crawl_flights.stats(),
+    }
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(app, host="0.0.0.0", port=CRAWL4AI_PORT)